@@ -1,7 +1,29 @@
+import os  # Импорт os для работы с путями, переменными окружения и числом доступных ядер
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")  # Без приветствия pygame в stdout: туда могут идти кадры анимации
 import pygame  # Импорт библиотеки Pygame для создания графического интерфейса и работы с окнами
 import numpy as np  # Импорт NumPy для работы с массивами и математическими функциями
 import sys  # Импорт sys для доступа к системным функциям, таким как завершение программы
+import argparse  # Разбор аргументов командной строки для пакетного режима
+import itertools  # Декартово произведение параметров при переборе (sweep)
+import json  # Машиночитаемые результаты бенчмарка
+import platform  # Сведения об окружении в отчёте бенчмарка
+import threading  # Фоновый поток для вычисления геометрии
+import queue  # Ограниченные очереди между этапами конвейера анимации
+import time  # Замер времени с последнего изменения параметров (прогрессивная детализация)
+import copy  # Поверхностная копия сетки при перепроецировании (мировые массивы общие)
+import functools  # lru_cache для общих буферов топологии сетки
 import datetime  # Импорт datetime для работы с датой и временем, используется при сохранении скриншотов
+import ast  # Проверка пользовательских формул по белому списку узлов синтаксического дерева
+import hashlib  # Ключ дискового кэша скомпилированных формул
+import marshal  # Сериализация байт-кода скомпилированных формул
+from concurrent.futures import ProcessPoolExecutor, as_completed  # Пул процессов для параллельного пакетного рендеринга
+from collections import OrderedDict, deque  # Упорядоченный словарь — основа LRU-кэша геометрии; deque — кольцевые буферы профайлера
+from contextlib import contextmanager  # Замер этапов через блок with
+
+try:
+    import tomllib  # Чтение формул из TOML (стандартная библиотека с Python 3.11)
+except ImportError:
+    tomllib = None  # Без tomllib доступны только JSON-файлы формул
 
 
 # ------------------- ПАРАМЕТРИЧЕСКИЕ ПОВЕРХНОСТИ -------------------
@@ -76,6 +98,220 @@ surface_bounds = {
     "Helical": ((0, 360), (-5, 5))
 }
 
+# Начальные значения параметров alpha и beta при выборе поверхности
+surface_defaults = {
+    "Seashell": (0.1, 0.05),
+    "Mobius": (0.1, 0.05),
+    "Torus": (0.1, 0.05),
+    "Spiral": (0.1, 0.05),
+    "Helical": (0.1, 0.05)
+}
+
+
+# ------------------- ПОЛЬЗОВАТЕЛЬСКИЕ ФОРМУЛЫ -------------------
+FORMULA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "formulas")  # Файлы формул, загружаемые при запуске
+FORMULA_CACHE_DIR = os.path.join(FORMULA_DIR, "__pycache__")  # Скомпилированные формулы (ключ — хеш текста формулы)
+FORMULA_ARGS = ("u", "v", "alpha", "beta")  # Переменные, доступные в формуле
+FORMULA_CONSTANTS = {"pi": np.pi, "e": np.e, "tau": 2 * np.pi}
+FORMULA_FUNCTIONS = {  # Функции, разрешённые в формулах; все поэлементные, работают с массивами сетки
+    name: getattr(np, name) for name in (
+        "sin", "cos", "tan", "arcsin", "arccos", "arctan", "arctan2", "sinh", "cosh", "tanh",
+        "exp", "log", "log10", "sqrt", "abs", "radians", "degrees", "floor", "ceil", "sign",
+        "minimum", "maximum", "hypot")
+}
+FORMULA_MAX_EXPONENT = 64  # Наибольший постоянный показатель степени (больше — почти наверняка ошибка или зависание)
+FORMULA_TRIAL_POINTS = 5  # Пробное вычисление новой формулы на сетке 5x5 при загрузке
+FORMULA_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Load, ast.Constant,
+                 ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.UAdd, ast.USub)
+
+
+class FormulaError(ValueError):
+    pass
+
+
+def check_formula(text):
+    try:
+        tree = ast.parse(str(text), mode="eval")
+    except SyntaxError as err:
+        raise FormulaError(f"syntax error in '{text}': {err.msg}")
+    for node in ast.walk(tree):  # Никаких атрибутов, индексов, лямбд и т.п. — только арифметика и функции из списка
+        if not isinstance(node, FORMULA_NODES):
+            raise FormulaError(f"'{type(node).__name__}' is not allowed in '{text}'")
+        if isinstance(node, ast.Constant) and (type(node.value) not in (int, float)):
+            raise FormulaError(f"only numeric constants are allowed in '{text}'")
+        if isinstance(node, ast.Name) and node.id not in FORMULA_ARGS + tuple(FORMULA_CONSTANTS) + tuple(FORMULA_FUNCTIONS):
+            raise FormulaError(f"unknown name '{node.id}' in '{text}'")
+        if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.func.id not in FORMULA_FUNCTIONS
+                                           or node.keywords):
+            raise FormulaError(f"only calls like {'/'.join(list(FORMULA_FUNCTIONS)[:3])}/...(x) are allowed in '{text}'")
+        if isinstance(node, ast.Call) and len(node.args) != FORMULA_FUNCTIONS[node.func.id].nin:
+            # Лишний аргумент ufunc молча стал бы выходным массивом out= и затёр бы u или v
+            raise FormulaError(f"{node.func.id}() takes {FORMULA_FUNCTIONS[node.func.id].nin} argument(s) in '{text}'")
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow):
+            check_exponent(node.right, text)
+        if isinstance(node, ast.Constant) and type(node.value) is int:
+            node.value = float(node.value)  # Целые константы — вещественные: без длинной арифметики вида 9**9**9
+    return ast.unparse(tree)  # Нормализованный текст: одинаковые формулы дают одинаковый ключ кэша
+
+
+def check_exponent(node, text):
+    if any(isinstance(n, ast.Name) and n.id in FORMULA_ARGS for n in ast.walk(node)):
+        return  # Показатель зависит от сетки или параметров — считается в NumPy, переполнение даёт inf
+    value = node
+    sign = 1
+    while isinstance(value, ast.UnaryOp):  # Допускается только число со знаком или константа вроде pi
+        sign = -sign if isinstance(value.op, ast.USub) else sign
+        value = value.operand
+    if isinstance(value, ast.Constant):
+        value = value.value
+    elif isinstance(value, ast.Name) and value.id in FORMULA_CONSTANTS:
+        value = FORMULA_CONSTANTS[value.id]
+    else:
+        raise FormulaError(f"constant exponent must be a plain number in '{text}'")
+    if abs(sign * value) > FORMULA_MAX_EXPONENT:
+        raise FormulaError(f"exponent {sign * value:g} is larger than {FORMULA_MAX_EXPONENT} in '{text}'")
+
+
+def formula_kernel_source(spec):
+    x, y, z = (check_formula(spec[axis]) for axis in "xyz")
+    # Одна функция на всю сетку: u и v — массивы, поэтому формула вычисляется векторно за один вызов
+    return f"def kernel({', '.join(FORMULA_ARGS)}):\n    return ({x}), ({y}), ({z})\n"
+
+
+def compile_formula(source, cache_path):
+    code = compile(source, "<formula>", "exec")
+    store_formula(code, cache_path)
+    return code
+
+
+def store_formula(code, cache_path):
+    tmp = f"{cache_path}.{os.getpid()}.tmp"  # Запись через временный файл: процессы пакетного режима могут писать одновременно
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(marshal.dumps(code))
+        os.replace(tmp, cache_path)
+    except OSError as err:  # Каталог только для чтения: формула работает, но компилируется при каждом запуске
+        print(f"Cannot cache formula: {err}", file=sys.stderr)
+
+
+def load_kernel(source, cache_path):
+    try:
+        with open(cache_path, "rb") as f:
+            code = marshal.loads(f.read())  # Байт-код из кэша: разбор и компиляция не повторяются
+    except (OSError, EOFError, ValueError, TypeError):
+        code = compile_formula(source, cache_path)  # Кэш отсутствует или повреждён
+    return make_kernel(code)
+
+
+def make_kernel(code):
+    namespace = {"__builtins__": {}, **FORMULA_CONSTANTS, **FORMULA_FUNCTIONS}
+    exec(code, namespace)
+    return namespace["kernel"]
+
+
+def trial_formula(name, kernel, bounds, defaults):
+    (u0, u1), (v0, v1) = bounds
+    n = FORMULA_TRIAL_POINTS
+    try:
+        with np.errstate(all="ignore"):  # Деление на ноль и т.п. проверяются ниже по результату
+            grid = evaluate_surface(kernel, np.linspace(u0, u1, n), np.linspace(v0, v1, n), *defaults)
+    except Exception as err:
+        raise FormulaError(f"'{name}': evaluation failed: {err!r}")
+    if grid.shape != (n, n, 3):
+        raise FormulaError(f"'{name}': expected a ({n}, {n}, 3) grid, got {grid.shape}")
+    if not np.isfinite(grid).all():
+        raise FormulaError(f"'{name}': non-finite coordinates (inf/nan) within u={bounds[0]}, v={bounds[1]}")
+
+
+class FormulaSurface:
+    def __init__(self, name, source, cache_path):
+        self.name = name
+        self.source = source            # Текст функции-ядра, прошедший проверку
+        self.cache_path = cache_path    # Файл с байт-кодом ядра
+        self.kernel = None              # Загружается при первом вычислении поверхности
+
+    def __call__(self, u, v, alpha, beta):
+        if self.kernel is None:
+            self.kernel = load_kernel(self.source, self.cache_path)
+        return self.kernel(u, v, alpha, beta)
+
+
+def read_formula_file(path):
+    if path.endswith(".toml"):
+        if tomllib is None:
+            raise FormulaError("TOML needs Python 3.11+ (use JSON instead)")
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    else:
+        with open(path) as f:
+            data = json.load(f)
+    specs = data.get("surface", []) if isinstance(data, dict) else data  # Таблица [[surface]] или список объектов
+    if not isinstance(specs, list):
+        raise FormulaError("expected a list of surfaces")
+    return specs
+
+
+def register_formula(spec):
+    if not isinstance(spec, dict):
+        raise FormulaError("surface definition must be a table/object")
+    missing = [key for key in ("name", "x", "y", "z", "u", "v") if key not in spec]
+    if missing:
+        raise FormulaError(f"missing {', '.join(missing)}")
+    name = str(spec["name"])
+    if name in surfaces and not isinstance(surfaces[name], FormulaSurface):
+        raise FormulaError(f"'{name}' is a built-in surface")
+    try:
+        bounds = tuple((float(lo), float(hi)) for lo, hi in (spec["u"], spec["v"]))
+        defaults = (float(spec.get("alpha", 0.1)), float(spec.get("beta", 0.05)))
+    except (TypeError, ValueError):
+        raise FormulaError(f"'{name}': u and v must be [min, max], alpha and beta numbers")
+
+    source = formula_kernel_source(spec)
+    # Байт-код зависит от версии Python; диапазоны и параметры входят в ключ, потому что пробное вычисление зависит от них
+    checked = f"{sys.implementation.cache_tag}\n{bounds}\n{defaults}\n{source}"
+    key = hashlib.sha256(checked.encode()).hexdigest()
+    cache_path = os.path.join(FORMULA_CACHE_DIR, f"{key}.bin")
+    if not os.path.exists(cache_path):
+        # Новая формула компилируется и пробно вычисляется один раз; в кэш попадает только прошедшая проверку,
+        # поэтому при следующих запусках проверяется лишь наличие файла
+        try:
+            code = compile(source, "<formula>", "exec")
+        except (SyntaxError, ValueError, OverflowError) as err:
+            raise FormulaError(f"'{name}': {err}")
+        trial_formula(name, make_kernel(code), bounds, defaults)
+        store_formula(code, cache_path)
+    surfaces[name] = FormulaSurface(name, source, cache_path)
+    surface_bounds[name] = bounds
+    surface_defaults[name] = defaults
+    return name
+
+
+def formula_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for entry in sorted(os.listdir(path)):
+                if entry.endswith((".toml", ".json")):
+                    yield os.path.join(path, entry)
+        elif os.path.exists(path):
+            yield path
+
+
+def load_formulas(paths):
+    loaded = []
+    for path in formula_files(paths):
+        try:
+            specs = read_formula_file(path)
+        except (OSError, ValueError) as err:  # ValueError покрывает FormulaError, ошибки JSON и TOML
+            print(f"Skipping {path}: {err}", file=sys.stderr)
+            continue
+        for spec in specs:
+            try:
+                loaded.append(register_formula(spec))
+            except FormulaError as err:  # Ошибка в одной формуле не мешает остальным
+                print(f"Skipping surface in {path}: {err}", file=sys.stderr)
+    return loaded
+
 current_surface_name = None
 
 # ------------------- НАСТРОЙКИ -------------------
@@ -88,6 +324,49 @@ res_u, res_v = 64, 64                   # Разрешение сетки по u
 
 width, height = 1000, 800              # Размер окна визуализации (ширина и высота)
 
+RASTER_CHUNK_PIXELS = 4_000_000         # Сколько пикселей-кандидатов растеризатор обрабатывает за один проход (ограничивает память)
+
+LOD_FACTORS = (8, 4, 2, 1)              # Уровни прогрессивной детализации: доля от res_u/res_v (1/8, 1/4, 1/2, полная)
+LOD_SETTLE_SECONDS = 0.25               # Сколько параметры должны не меняться, прежде чем сетка начнёт уточняться
+
+ADAPTIVE_TOLERANCE_PX = 0.5             # Допустимое отклонение хорды от поверхности (в пикселях) при адаптивном разбиении
+ADAPTIVE_START = 5                      # Начальное число отсчётов по каждой оси при адаптивном разбиении
+ADAPTIVE_REFERENCE_DISTANCE = 250.0     # Расстояние камеры, для которого считается допуск: сетка не зависит от текущего зума
+
+EXPORT_STRIP_ROWS = 64                  # Сколько строк сетки (по u) экспорт вычисляет и пишет за раз — ограничивает пиковую память
+EXPORT_FORMATS = ("ply", "stl", "obj")  # Форматы экспорта сетки: бинарный PLY, бинарный STL, текстовый OBJ
+
+PROFILER_MAX_EVENTS = 100_000           # Сколько последних замеров хранит профайлер для экспорта трассы
+PROFILER_HISTORY = 120                  # Сколько последних кадров показывает гистограмма времени кадра
+PROFILER_STAGES = ("events", "evaluate", "project", "edges", "polygons", "cull", "sort",
+                   "fill", "lines", "axes", "render", "panel", "flip", "tick", "frame")  # Порядок строк в оверлее
+
+ANIM_QUEUE_FRAMES = 2                   # Сколько готовых сеток и кадров может ждать следующий этап анимации (ограничивает память)
+ANIM_FORMATS = ("png", "raw")           # Вывод анимации: пронумерованные PNG или сырой RGB24 в файл/канал
+ANIM_EASINGS = ("linear", "smooth")     # Интерполяция между ключевыми кадрами: линейная или smoothstep
+
+TEXT_CACHE_SIZE = 512                   # Сколько отрендеренных подписей (текст и цвет) держит кэш интерфейса
+BUTTON_CACHE_SIZE = 256                 # Сколько готовых поверхностей кнопок (размер, подпись, наведение) держит кэш
+
+WIRE_DECIMATED_LINES = 48               # Сколько линий по каждой оси оставляет прореженный каркас
+
+CULL_SUBPIXEL_AREA = 0.5                # Полигоны с экранной площадью меньше этой (пиксели²) считаются субпиксельными
+
+FILL_MODES = ("painter", "zbuffer")     # Способы заливки: алгоритм художника (pygame.draw.polygon) или Z-буфер на NumPy
+LOD_MODES = ("progressive", "off")      # Прогрессивная детализация при изменении параметров или сразу полная сетка
+TESS_MODES = ("uniform", "adaptive")    # Равномерная сетка linspace или адаптивная по кривизне (res_u/res_v — верхняя граница)
+PROFILER_MODES = ("off", "on")          # Оверлей с временем этапов кадра
+WIRE_MODES = ("segments", "polylines", "antialiased", "decimated")  # Каркас: по отрезку на ребро, ломаными по строкам и столбцам, сглаженными ломаными или каждая k-я линия
+CULL_MODES = ("viewport", "subpixel", "backface", "off")  # Отсечение полигонов: вне окна; плюс субпиксельные; плюс обратные грани; без отсечения
+render_settings = {"fill": "painter", "lod": "progressive", "tess": "uniform", "profiler": "off",
+                   "wire": "segments", "cull": "viewport"}  # Текущие режимы отрисовки, переключаются кнопками панели
+mode_options = {"fill": FILL_MODES, "lod": LOD_MODES, "tess": TESS_MODES,
+                "profiler": PROFILER_MODES, "wire": WIRE_MODES, "cull": CULL_MODES}  # Допустимые значения каждого режима (кнопка перебирает их по кругу)
+
+TOPOLOGY_CACHE_SIZE = 8                 # Сколько буферов топологии (рёбра и полигоны для размера сетки) держать в памяти
+
+GEOMETRY_CACHE_BYTES = 256 * 1024 * 1024  # Бюджет памяти кэша геометрии (байты); при превышении вытесняются давно не использованные записи
+
 # Цвета (тёмная тема)
 BG_COLOR = (15, 15, 25)                 # Цвет фона (тёмно-синий)
 LINE_COLOR = (80, 80, 120, 255)         # Цвет линий сетки (приглушённый синий с полной прозрачностью)
@@ -98,12 +377,17 @@ BUTTON_HOVER_COLOR = (60, 60, 90)       # Цвет кнопок при наве
 BUTTON_TEXT_COLOR = (255, 255, 255)     # Цвет текста на кнопках
 TEXT_COLOR = (180, 180, 200)            # Цвет основного текста (светло-серый)
 
+ORBIT_SENSITIVITY = 0.3                 # Градусов поворота камеры на пиксель перетаскивания мышью
+ZOOM_STEP = 1.1                         # Во сколько раз меняется расстояние до камеры за один шаг колёсика
+CAMERA_R_LIMITS = (20, 2000)            # Допустимое расстояние от камеры до центра сцены
+CAMERA_THETA_LIMITS = (5, 175)          # Допустимый наклон камеры (градусы); у полюсов базис камеры вырождается
+
 
 # ------------------- КАМЕРА -------------------
-def setup_camera():
-    theta = np.radians(60)                     # Угол наклона камеры вниз в радианах (60 градусов)
-    phi = np.radians(30)                       # Угол поворота камеры в горизонтальной плоскости (30 градусов)
-    r = 250                                    # Расстояние от камеры до центра сцены
+def setup_camera(theta_deg=60, phi_deg=30, r=250):
+    theta = np.radians(theta_deg)              # Угол наклона камеры вниз в радианах (по умолчанию 60 градусов)
+    phi = np.radians(phi_deg)                  # Угол поворота камеры в горизонтальной плоскости (по умолчанию 30 градусов)
+                                               # r — расстояние от камеры до центра сцены
 
     x_cam = r * np.sin(theta) * np.cos(phi)    # Координата X позиции камеры в сферических координатах
     y_cam = r * np.sin(theta) * np.sin(phi)    # Координата Y позиции камеры в сферических координатах
@@ -122,14 +406,42 @@ def setup_camera():
 
     return np.array([x_cam, y_cam, z_cam]), right, up, forward  # Возврат позиции камеры и трёх ортонормированных векторов
 
+
+def camera_matrix(cam_pos, right, up, forward):
+    view = np.eye(4)                          # Матрица вида 4x4: поворот в базис камеры и перенос начала в камеру
+    view[:3, :3] = (right, up, forward)
+    view[:3, 3] = -view[:3, :3] @ cam_pos
+    return view
+
+
 x_cam, right, up, forward = setup_camera()    # Получение позиции камеры и базисных векторов направления
+camera_state = {"theta": 60.0, "phi": 30.0, "r": 250.0}  # Сферические координаты камеры (градусы и расстояние)
+camera_view = (0, camera_matrix(x_cam, right, up, forward))  # (версия, матрица вида); версия растёт при каждом движении камеры
+
+
+def set_camera(theta, phi, r):
+    global x_cam, right, up, forward, camera_view
+    theta = min(max(theta, CAMERA_THETA_LIMITS[0]), CAMERA_THETA_LIMITS[1])
+    r = min(max(r, CAMERA_R_LIMITS[0]), CAMERA_R_LIMITS[1])
+    camera_state.update(theta=theta, phi=phi % 360, r=r)
+    x_cam, right, up, forward = setup_camera(theta, phi, r)
+    camera_view = (camera_view[0] + 1, camera_matrix(x_cam, right, up, forward))  # Одно присваивание — фоновый поток видит согласованную пару
+
+
+def orbit_camera(dx, dy):
+    set_camera(camera_state["theta"] - dy * ORBIT_SENSITIVITY,  # Перетаскивание вверх-вниз меняет наклон,
+               camera_state["phi"] - dx * ORBIT_SENSITIVITY,    # влево-вправо — поворот вокруг оси Z
+               camera_state["r"])
+
+
+def zoom_camera(steps):
+    set_camera(camera_state["theta"], camera_state["phi"], camera_state["r"] / ZOOM_STEP ** steps)  # Колёсико от себя — ближе
 
 
 # ------------------- ПРОЕКЦИЯ -------------------
 def rotate_to_camera(x, y, z):
-    rot_matrix = np.array([right, up, forward])  # Матрица из трёх векторов камеры: "вправо", "вверх", "вперёд"
-    vec = np.array([x - x_cam[0], y - x_cam[1], z - x_cam[2]])  # Вектор от позиции камеры до заданной точки
-    return rot_matrix @ vec  # Умножение матрицы поворота на вектор — переход в систему координат камеры
+    view = camera_view[1]  # Заранее построенная матрица вида: "вправо", "вверх", "вперёд" и перенос в позицию камеры
+    return view[:3, :3] @ np.array([x, y, z]) + view[:3, 3]  # Переход точки в систему координат камеры
 
 def project_point(x, y, z, width, height, scale=50, perspective=True, d=1000):
     x, y, z = rotate_to_camera(x, y, z)  # Преобразование точки в координатную систему камеры
@@ -149,6 +461,30 @@ def project_point(x, y, z, width, height, scale=50, perspective=True, d=1000):
     return [int(x_proj), int(y_proj), distance]  # Возврат экранных координат и расстояния до точки
 
 
+def project_points(points, width, height, scale=50, perspective=True, d=1000, view=None):
+    points = np.asarray(points, dtype=float).reshape(-1, 3)          # Массив точек формы (N, 3)
+    view = camera_view[1] if view is None else view                  # Матрица вида 4x4 текущей камеры
+    cam = points @ view[:3, :3].T + view[:3, 3]                      # Переход всех точек в систему координат камеры
+    x, y, z = cam[:, 0], cam[:, 1], cam[:, 2]
+
+    visible = (z > 1e-3) & np.isfinite(x + y + z)                    # Та же отсечка, что и в project_point, плюс защита от inf/nan
+
+    if perspective:                                                  # Перспективная проекция
+        factor = np.divide(d, z, out=np.zeros_like(z), where=visible) * scale
+    else:                                                            # Ортографическая проекция
+        factor = np.full_like(z, scale)
+
+    x_proj = np.where(visible, x * factor + width // 2, 0)           # Экранная координата X (для невидимых точек — 0)
+    y_proj = np.where(visible, -y * factor + height // 2, 0)         # Экранная координата Y (ось Y направлена вниз)
+
+    screen_xy = np.empty((len(points), 2), dtype=np.int32)
+    screen_xy[:, 0] = np.clip(x_proj, -2 ** 30, 2 ** 30)             # Отбрасывание дробной части, как int() в project_point;
+    screen_xy[:, 1] = np.clip(y_proj, -2 ** 30, 2 ** 30)             # точки у самой камеры не переполняют int32
+
+    depth = np.sqrt(np.einsum('ij,ij->i', cam, cam))                 # Расстояние до каждой точки от камеры
+    return screen_xy, depth, visible                                 # Экранные координаты, глубины и маска видимости
+
+
 def project_line(start, end, color):
     p1 = project_point(*start, width, height)  # Проецирование начальной точки линии
     p2 = project_point(*end, width, height)    # Проецирование конечной точки линии
@@ -161,165 +497,597 @@ def project_line(start, end, color):
 
 # ------------------- GUI -------------------
 
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def render_text(font, text, color):
+    return font.render(text, True, color)  # Подпись растеризуется шрифтом один раз, дальше берётся готовая поверхность
+
+
+@functools.lru_cache(maxsize=BUTTON_CACHE_SIZE)
+def button_surface(font, size, label, hovered=False, align="center"):
+    surface = pygame.Surface(size, pygame.SRCALPHA)  # Углы прозрачные: под скруглением остаётся то, что уже на экране
+    color = BUTTON_HOVER_COLOR if hovered else BUTTON_COLOR  # Выбор цвета кнопки в зависимости от наведения
+    pygame.draw.rect(surface, color, surface.get_rect(), border_radius=6)  # Прямоугольник с закруглёнными углами
+    text = render_text(font, label, BUTTON_TEXT_COLOR)  # Текстовая поверхность с подписью кнопки
+    if align == "left":
+        surface.blit(text, (10, 6))  # Название параметра прижато к левому краю
+    else:
+        surface.blit(text, text.get_rect(center=surface.get_rect().center))  # Центрирование текста внутри кнопки
+    return surface
+
+
 def create_button(rect, label, font, screen, mouse_pos):
     hovered = rect.collidepoint(mouse_pos)  # Проверка, наведена ли мышь на кнопку
-    color = BUTTON_HOVER_COLOR if hovered else BUTTON_COLOR  # Выбор цвета кнопки в зависимости от наведения
-    pygame.draw.rect(screen, color, rect, border_radius=6)  # Отрисовка прямоугольной кнопки с закруглёнными углами
-    text = font.render(label, True, BUTTON_TEXT_COLOR)  # Создание текстовой поверхности с подписью кнопки
-    text_rect = text.get_rect(center=rect.center)  # Центрирование текста внутри кнопки
-    screen.blit(text, text_rect)  # Отображение текста на кнопке
+    screen.blit(button_surface(font, rect.size, label, hovered), rect)  # Готовая поверхность кнопки в нужном состоянии
     return hovered  # Возврат флага наведения (используется для обработки клика)
 
 
-def draw_control_panel(screen, font, mouse_pos):
-    global res_u, res_v, param_a, param_b  # Использование глобальных параметров
+def control_value(key):
+    return {'a': param_a, 'b': param_b, 'u': res_u, 'v': res_v}[key]  # Текущее значение параметра панели
 
+
+def layout_control_panel():
     start_x = 10  # Начальная координата X панели
     start_y = 80  # Начальная координата Y панели
     btn_w = 180  # Ширина основной кнопки параметра
     btn_h = 35  # Высота кнопок
     gap_y = 15  # Вертикальный отступ между строками
 
-    controls = [  # Список всех параметров, которые можно изменять
-        ("Scale", param_a, a_step, 'a'),  # Масштаб
-        ("V-Resolution", res_v, 4, 'v'),  # Разрешение по v
-        ("U-Resolution", res_u, 4, 'u'),  # Разрешение по u
-        ("Detail", param_b, b_step, 'b')  # Детализация поверхности
-    ]
+    # Прямоугольники строятся один раз: раскладка панели не зависит от значений параметров
+    for i, (label, key) in enumerate(panel_controls):
+        y = start_y + i * (btn_h + gap_y)  # Расчёт Y координаты строки
+        control_buttons[key] = pygame.Rect(start_x, y, btn_w, btn_h)  # Основная кнопка с названием параметра
+        plus_buttons[key] = pygame.Rect(start_x + btn_w + 10, y, 40, btn_h)  # Кнопка "+"
+        minus_buttons[key] = pygame.Rect(start_x + btn_w + 60, y, 40, btn_h)  # Кнопка "-"
 
-    control_buttons.clear()  # Очистка словаря кнопок параметров
-    plus_buttons.clear()  # Очистка кнопок увеличения
-    minus_buttons.clear()  # Очистка кнопок уменьшения
+    mode_y = start_y + len(panel_controls) * (btn_h + gap_y)  # Режимы располагаются под параметрами
+    for i, (label, key) in enumerate(mode_controls):  # Кнопка для каждого режима отрисовки
+        mode_buttons[key] = pygame.Rect(start_x, mode_y + i * (btn_h + gap_y), btn_w + 100, btn_h)
+
+    control_buttons['back'] = pygame.Rect(10, 10, 100, 35)  # Кнопка "Back"
+    control_buttons['save'] = pygame.Rect(width - 110, 10, 100, 35)  # Кнопка "Save"
+    control_buttons['export'] = pygame.Rect(width - 220, 10, 100, 35)  # Кнопка "Export" рядом с "Save"
 
-    for i, (label, val, step, key) in enumerate(controls):  # Обработка каждого элемента панели
-        y = start_y + i * (btn_h + gap_y)  # Расчёт Y координаты строки
 
-        ctrl_rect = pygame.Rect(start_x, y, btn_w, btn_h)  # Прямоугольник основной кнопки
-        control_buttons[key] = ctrl_rect  # Сохранение кнопки в словарь по ключу
-        pygame.draw.rect(screen, BUTTON_COLOR, ctrl_rect, border_radius=6)  # Отрисовка основной кнопки
-        text = font.render(label, True, BUTTON_TEXT_COLOR)  # Рендер текста названия параметра
-        screen.blit(text, (ctrl_rect.x + 10, ctrl_rect.y + 6))  # Отображение названия параметра слева
-
-        plus_rect = pygame.Rect(start_x + btn_w + 10, y, 40, btn_h)  # Прямоугольник кнопки "+"
-        minus_rect = pygame.Rect(start_x + btn_w + 60, y, 40, btn_h)  # Прямоугольник кнопки "-"
-        plus_buttons[key] = plus_rect  # Сохранение "+" кнопки
-        minus_buttons[key] = minus_rect  # Сохранение "-" кнопки
-
-        for rect, sign in [(plus_rect, "+"), (minus_rect, "-")]:  # Отрисовка "+" и "-"
-            hovered = rect.collidepoint(mouse_pos)  # Проверка наведения на кнопку
-            color = BUTTON_HOVER_COLOR if hovered else BUTTON_COLOR  # Цвет по наведению
-            pygame.draw.rect(screen, color, rect, border_radius=6)  # Отрисовка кнопки
-            sign_text = font.render(sign, True, BUTTON_TEXT_COLOR)  # Рендер текста (“+” или “-”)
-            sign_rect = sign_text.get_rect(center=rect.center)  # Центрирование знака
-            screen.blit(sign_text, sign_rect)  # Отображение знака на кнопке
+def draw_control_panel(screen, font, mouse_pos):
+    for label, key in panel_controls:  # Обработка каждого элемента панели
+        ctrl_rect = control_buttons[key]
+        screen.blit(button_surface(font, ctrl_rect.size, label, align="left"), ctrl_rect)  # Кнопка с названием параметра
+        create_button(plus_buttons[key], "+", font, screen, mouse_pos)  # Отрисовка "+"
+        create_button(minus_buttons[key], "-", font, screen, mouse_pos)  # Отрисовка "-"
 
+        val = control_value(key)
         val_str = f"{val:.2f}" if isinstance(val, float) else str(val)  # Форматирование значения
-        val_text = font.render(val_str, True, BUTTON_TEXT_COLOR)  # Рендер значения параметра
-        val_x = start_x + btn_w + 110  # Координата X для значения
-        val_y = y + (btn_h - val_text.get_height()) // 2  # Центровка по Y
-        screen.blit(val_text, (val_x, val_y))  # Отображение значения
+        val_text = render_text(font, val_str, BUTTON_TEXT_COLOR)  # Значение параметра (из кэша подписей)
+        val_y = ctrl_rect.y + (ctrl_rect.height - val_text.get_height()) // 2  # Центровка по Y
+        screen.blit(val_text, (ctrl_rect.right + 110, val_y))  # Отображение значения
+
+    for label, key in mode_controls:  # Кнопка с текущим значением каждого режима
+        create_button(mode_buttons[key], f"{label}: {render_settings[key]}", font, screen, mouse_pos)
 
 
 def draw_menu_buttons(screen, font, mouse_pos):
-    title_text = "Select surface to render"  # Заголовок меню выбора поверхности
-    title_render = font.render(title_text, True, TEXT_COLOR)  # Рендер заголовка
+    title_render = render_text(font, "Select surface to render", TEXT_COLOR)  # Заголовок меню выбора поверхности
     title_rect = title_render.get_rect(center=(width // 2, 40))  # Центровка заголовка по центру экрана
     screen.blit(title_render, title_rect)  # Отображение заголовка
 
     btn_w, btn_h = 160, 40  # Размеры кнопок меню
-    gap_y = 15  # Отступ между кнопками
-    total_height = len(surfaces) * (btn_h + gap_y) - gap_y  # Общая высота блока кнопок
+    gap_x, gap_y = 20, 15  # Отступы между кнопками
+    max_rows = max(1, (height - 100) // (btn_h + gap_y))  # Сколько кнопок помещается в столбец под заголовком
+    max_columns = max(1, (width - 40 + gap_x) // (btn_w + gap_x))  # Сколько столбцов помещается в окно
+    columns = -(-len(surfaces) // max_rows)  # Поверхности из файлов формул раскладываются в несколько столбцов
+    rows = -(-len(surfaces) // columns)
+    menu_state["scroll"] = min(max(menu_state["scroll"], 0), max(columns - max_columns, 0))  # Прокрутка колёсиком
+    first = menu_state["scroll"]  # Первый видимый столбец
+    total_width = min(columns, max_columns) * (btn_w + gap_x) - gap_x  # Общая ширина блока кнопок
+    total_height = rows * (btn_h + gap_y) - gap_y  # Общая высота блока кнопок
+    start_x = (width - total_width) // 2  # Начальная X координата (по центру)
     start_y = (height - total_height) // 2  # Начальная Y координата (по центру)
 
-    surface_button_rects.clear()  # Очистка кнопок выбора поверхностей
-    mouse_pos = pygame.mouse.get_pos()  # Получение текущей позиции мыши
+    surface_button_rects.clear()  # Раскладка меняется только при прокрутке или новом наборе поверхностей
 
     for i, name in enumerate(surfaces.keys()):  # Создание кнопки для каждой поверхности
-        x = (width - btn_w) // 2  # Центровка по горизонтали
-        y = start_y + i * (btn_h + gap_y)  # Расчёт координаты Y
+        column = i // rows - first
+        if not 0 <= column < max_columns:  # Столбец прокручен за пределы окна
+            continue
+        x = start_x + column * (btn_w + gap_x)  # Столбец кнопки
+        y = start_y + (i % rows) * (btn_h + gap_y)  # Расчёт координаты Y
         rect = pygame.Rect(x, y, btn_w, btn_h)  # Прямоугольник кнопки
         surface_button_rects[name] = rect  # Сохранение кнопки
-        hovered = rect.collidepoint(mouse_pos)  # Проверка наведения
-        color = BUTTON_HOVER_COLOR if hovered else BUTTON_COLOR  # Цвет кнопки
-        pygame.draw.rect(screen, color, rect, border_radius=6)  # Отрисовка кнопки
-        text = font.render(name, True, BUTTON_TEXT_COLOR)  # Рендер имени поверхности
-        text_rect = text.get_rect(center=rect.center)  # Центровка текста
-        screen.blit(text, text_rect)  # Отображение текста
+        create_button(rect, name, font, screen, mouse_pos)  # Отрисовка кнопки с именем поверхности
 
 
 def draw_menu_back_and_save(screen, font, mouse_pos):
-    back_rect = pygame.Rect(10, 10, 100, 35)  # Прямоугольник кнопки "Back"
-    control_buttons['back'] = back_rect  # Сохранение кнопки в словарь
-    hovered_back = back_rect.collidepoint(mouse_pos)  # Проверка наведения
-    back_color = BUTTON_HOVER_COLOR if hovered_back else BUTTON_COLOR  # Цвет кнопки
-    pygame.draw.rect(screen, back_color, back_rect, border_radius=6)  # Отрисовка кнопки
-    back_text = font.render("Back", True, BUTTON_TEXT_COLOR)  # Рендер текста
-    back_text_rect = back_text.get_rect(center=back_rect.center)  # Центровка текста
-    screen.blit(back_text, back_text_rect)  # Отображение текста кнопки
-
-    save_rect = pygame.Rect(width - 110, 10, 100, 35)  # Прямоугольник кнопки "Save"
-    control_buttons['save'] = save_rect  # Сохранение кнопки в словарь
-    hovered_save = save_rect.collidepoint(mouse_pos)  # Проверка наведения
-    save_color = BUTTON_HOVER_COLOR if hovered_save else BUTTON_COLOR  # Цвет кнопки
-    pygame.draw.rect(screen, save_color, save_rect, border_radius=6)  # Отрисовка кнопки
-    save_text = font.render("Save", True, BUTTON_TEXT_COLOR)  # Рендер текста
-    save_text_rect = save_text.get_rect(center=save_rect.center)  # Центровка текста
-    screen.blit(save_text, save_text_rect)  # Отображение текста кнопки
+    create_button(control_buttons['back'], "Back", font, screen, mouse_pos)  # Отрисовка кнопки "Back"
+    create_button(control_buttons['save'], "Save", font, screen, mouse_pos)  # Отрисовка кнопки "Save"
+    create_button(control_buttons['export'], "Export", font, screen, mouse_pos)  # Отрисовка кнопки экспорта сетки
+
+
+def hover_buttons(in_menu):
+    if in_menu:  # Кнопки, которые меняют вид при наведении: (прямоугольник, подпись)
+        return list(zip(surface_button_rects.values(), surface_button_rects.keys()))
+    buttons = [(control_buttons['back'], "Back"), (control_buttons['save'], "Save"),
+               (control_buttons['export'], "Export")]
+    for label, key in panel_controls:
+        buttons += [(plus_buttons[key], "+"), (minus_buttons[key], "-")]
+    buttons += [(mode_buttons[key], f"{label}: {render_settings[key]}") for label, key in mode_controls]
+    return buttons
+
+
+def hovered_button(buttons, mouse_pos):
+    return next((i for i, (rect, _) in enumerate(buttons) if rect.collidepoint(mouse_pos)), None)
+
+
+def update_hover(screen, font, buttons, mouse_pos):
+    hovered = hovered_button(buttons, mouse_pos)
+    previous, ui_state["hover"] = ui_state["hover"], hovered
+    if hovered == previous:  # Наведение не изменилось — перерисовывать нечего
+        return []
+    dirty = []
+    for i in (previous, hovered):  # Перерисовываются только кнопка, с которой ушла мышь, и кнопка под мышью
+        if i is not None:
+            rect, label = buttons[i]
+            screen.blit(button_surface(font, rect.size, label, i == hovered), rect)
+            dirty.append(rect)
+    return dirty
+
+
+# ------------------- ПРОФИЛИРОВАНИЕ -------------------
+class FrameProfiler:
+    def __init__(self, max_events=PROFILER_MAX_EVENTS, history=PROFILER_HISTORY):
+        self.events = deque(maxlen=max_events)   # (этап, начало, длительность, имя потока) для экспорта трассы
+        self.frame_times = deque(maxlen=history)  # Длительности последних кадров (секунды)
+        self.last = {}                           # Этап -> длительность последнего замера (секунды)
+        self.frame_start = None
+        self.lock = threading.Lock()             # Замеры приходят и из главного, и из фонового потока
+        self.cull_stats = None                   # Счётчики отсечения полигонов последней проекции
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start)
+
+    def record(self, name, start, duration):
+        with self.lock:
+            self.events.append((name, start, duration, threading.current_thread().name))
+            self.last[name] = duration
+
+    def begin_frame(self):
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        if self.frame_start is None:
+            return
+        duration = time.perf_counter() - self.frame_start
+        self.record("frame", self.frame_start, duration)
+        self.frame_times.append(duration)
+
+    def fps(self):
+        if not self.frame_times:
+            return 0.0
+        return len(self.frame_times) / sum(self.frame_times)
+
+    def export_chrome_trace(self, path, log=None):  # log=None — print пишет в sys.stdout
+        with self.lock:
+            events = list(self.events)
+        threads = {}                             # Имя потока -> номер tid в трассе
+        trace = []
+        for name, start, duration, thread in events:
+            tid = threads.setdefault(thread, len(threads) + 1)
+            trace.append({"name": name, "ph": "X", "pid": 1, "tid": tid,
+                          "ts": start * 1e6, "dur": duration * 1e6})  # Формат Chrome trace: микросекунды
+        for thread, tid in threads.items():
+            trace.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": thread}})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+        print(f"Saved trace: {path} ({len(events)} events)", file=log)
+
+
+profiler = FrameProfiler()  # Общий профайлер: этапы render_surface и основного цикла
+
+
+def draw_profiler_overlay(screen, font):
+    x, y = width - 230, 55                              # Оверлей под кнопкой "Save"
+    panel = pygame.Rect(x - 10, y - 5, 230, 20 * (len(PROFILER_STAGES) + 5) + 75)
+    pygame.draw.rect(screen, BUTTON_COLOR, panel, border_radius=6)
+
+    fps_text = font.render(f"FPS: {profiler.fps():.1f}", True, BUTTON_TEXT_COLOR)
+    screen.blit(fps_text, (x, y))
+    for i, stage in enumerate(PROFILER_STAGES):         # Время последнего замера каждого этапа
+        ms = profiler.last.get(stage)
+        label = f"{stage}: {ms * 1000:.1f} ms" if ms is not None else f"{stage}: -"
+        screen.blit(font.render(label, True, TEXT_COLOR), (x, y + 20 * (i + 1)))
+
+    stats = profiler.cull_stats                         # Сколько полигонов отброшено каждой проверкой отсечения
+    if stats is not None:
+        lines = (f"quads: {stats['drawn']}/{stats['input']}",
+                 f"-view {stats['viewport']} -sub {stats['subpixel']} -back {stats['backface']}")
+        for i, line in enumerate(lines):
+            screen.blit(font.render(line, True, TEXT_COLOR), (x, y + 20 * (len(PROFILER_STAGES) + 1 + i)))
+
+    cache = geometry_cache.stats()                      # Работа LRU-кэша геометрии: попадания, промахи, вытеснения и занятая память
+    lines = (f"cache: hit {cache['hits']} miss {cache['misses']} evict {cache['evictions']}",
+             f"{cache['entries']} meshes, {cache['bytes'] / 2**20:.0f}/{cache['max_bytes'] / 2**20:.0f} MB")
+    for i, line in enumerate(lines):
+        screen.blit(font.render(line, True, TEXT_COLOR), (x, y + 20 * (len(PROFILER_STAGES) + 3 + i)))
+
+    hist_bottom = panel.bottom - 10                     # Гистограмма длительности последних кадров
+    for i, duration in enumerate(profiler.frame_times):
+        bar_h = min(int(duration * 1000), 60)           # 1 пиксель на миллисекунду, не выше 60
+        color = AXIS_COLORS[1] if duration <= 1 / 30 else AXIS_COLORS[0]  # Красный — кадр дольше бюджета 30 FPS
+        pygame.draw.line(screen, color, (x + i * 210 // PROFILER_HISTORY, hist_bottom),
+                         (x + i * 210 // PROFILER_HISTORY, hist_bottom - bar_h))
+
+
+# ------------------- КЭШ ГЕОМЕТРИИ -------------------
+class GeometryCache:
+    def __init__(self, max_bytes=GEOMETRY_CACHE_BYTES):
+        self.max_bytes = max_bytes          # Бюджет памяти в байтах
+        self.entries = OrderedDict()        # Ключ -> (сетка, размер при записи); порядок — от давно использованных к недавним
+        self.used_bytes = 0                 # Сколько памяти занимают записи сейчас
+        self.hits = 0                       # Счётчик попаданий
+        self.misses = 0                     # Счётчик промахов
+        self.evictions = 0                  # Счётчик вытесненных записей
+        self.lock = threading.Lock()        # Кэш используется и главным потоком, и фоновым вычислителем
+
+    @staticmethod
+    def entry_size(entry):
+        return entry.nbytes                 # Размер записи — объём её собственных массивов (общая топология не считается)
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)   # Запись становится самой свежей
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, entry):
+        size = self.entry_size(entry)
+        if size > self.max_bytes:           # Запись больше всего бюджета — не кэшируем
+            return
+        with self.lock:
+            if key in self.entries:
+                self.used_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (entry, size)  # Размер запоминается: сетка в кэше может дорасти (ленивая сортировка)
+            self.used_bytes += size
+            while self.used_bytes > self.max_bytes:  # Вытеснение давно не использованных записей
+                _, (_, old_size) = self.entries.popitem(last=False)
+                self.used_bytes -= old_size
+                self.evictions += 1
+
+    def contains(self, key):
+        with self.lock:
+            return key in self.entries  # Проверка без изменения счётчиков и порядка LRU
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self.entries), "bytes": self.used_bytes, "max_bytes": self.max_bytes}
+
+
+geometry_cache = GeometryCache()  # Общий кэш геометрии для всех поверхностей
+
+
+def geometry_key(name, u_lim, v_lim, alpha, beta, ru, rv, tess="uniform"):
+    # Параметры округляются, чтобы 0.1 + 0.05 - 0.05 попадало в ту же запись, что и 0.1
+    return (name, tuple(u_lim), tuple(v_lim), round(alpha, 9), round(beta, 9), ru, rv, tess)
 
 
 # ------------------- ОТРИСОВКА ПОВЕРХНОСТИ -------------------
-def render_surface(screen, font, save_to_file=False):
-    surface_func = surfaces[current_surface_name]                       # Получение функции текущей поверхности по её имени
-    u_range = np.linspace(u_limits[0], u_limits[1], res_u)             # Массив значений параметра u с равномерным шагом
-    v_range = np.linspace(v_limits[0], v_limits[1], res_v)             # Массив значений параметра v с равномерным шагом
+def evaluate_surface(surface_func, u_range, v_range, alpha, beta):
+    u_grid, v_grid = np.meshgrid(u_range, v_range, indexing='ij')      # Сетка параметров формы (res_u, res_v)
+    x, y, z = surface_func(u_grid, v_grid, alpha, beta)                # Один векторный вызов функции поверхности на всю сетку
+    x, y, z, _ = np.broadcast_arrays(x, y, z, u_grid)                  # Константные координаты (например, z = 0) растягиваются до размера сетки
+    return np.stack((x, y, z), axis=-1).astype(float)                  # Мировые координаты вершин формы (res_u, res_v, 3)
+
+
+def chord_error(surface_func, grid, u_range, v_range, alpha, beta, axis):
+    if axis == 0:                                                      # Середины интервалов по u для всех v
+        mid = evaluate_surface(surface_func, (u_range[:-1] + u_range[1:]) / 2, v_range, alpha, beta)
+        chord = (grid[:-1] + grid[1:]) / 2
+    else:                                                              # Середины интервалов по v для всех u
+        mid = evaluate_surface(surface_func, u_range, (v_range[:-1] + v_range[1:]) / 2, alpha, beta)
+        chord = (grid[:, :-1] + grid[:, 1:]) / 2
+    dev = np.linalg.norm(mid - chord, axis=-1)                         # Насколько середина хорды отходит от поверхности
+    dev = np.where(np.isfinite(dev), dev, 0.0)
+    return dev.max(axis=1 - axis)                                      # Худшее отклонение на каждом интервале
+
+
+def adaptive_ranges(surface_func, u_lim, v_lim, alpha, beta, max_u, max_v):
+    # Перевод мировых единиц в пиксели у центра сцены (масштаб и фокус как в project_point) при опорном расстоянии камеры:
+    # камера не входит в ключ кэша геометрии, поэтому разбиение от неё зависеть не должно
+    px_per_unit = 50 * 1000 / ADAPTIVE_REFERENCE_DISTANCE
+    ranges = [np.linspace(u_lim[0], u_lim[1], min(ADAPTIVE_START, max_u)),
+              np.linspace(v_lim[0], v_lim[1], min(ADAPTIVE_START, max_v))]
+    limits = (max_u, max_v)
+
+    while True:
+        grid = evaluate_surface(surface_func, ranges[0], ranges[1], alpha, beta)
+        new_ranges = list(ranges)
+        for axis in (0, 1):                                            # Интервалы делятся пополам по каждой оси отдельно
+            rng = ranges[axis]
+            budget = limits[axis] - len(rng)                           # Сколько ещё отсчётов можно добавить
+            if budget <= 0:
+                continue
+            err = chord_error(surface_func, grid, ranges[0], ranges[1], alpha, beta, axis) * px_per_unit
+            bad = np.flatnonzero(err > ADAPTIVE_TOLERANCE_PX)
+            if len(bad) == 0:
+                continue
+            bad = bad[np.argsort(-err[bad], kind='stable')[:budget]]   # При нехватке бюджета делятся худшие интервалы
+            new_ranges[axis] = np.sort(np.concatenate((rng, (rng[bad] + rng[bad + 1]) / 2)))
+        if all(a is b for a, b in zip(new_ranges, ranges)):            # Ни один интервал не пришлось делить
+            return ranges[0], ranges[1], grid
+        ranges = new_ranges
+
+
+class GridTopology:
+    def __init__(self, nu, nv):
+        self.shape = (nu, nv)
+        idx = np.arange(nu * nv, dtype=np.int32).reshape(nu, nv)      # Плоские индексы вершин
+        self.edges = np.concatenate((                                  # Все рёбра сетки (E, 2): сначала вдоль v, затем вдоль u
+            np.stack((idx[:, :-1].ravel(), idx[:, 1:].ravel()), axis=1),
+            np.stack((idx[:-1, :].ravel(), idx[1:, :].ravel()), axis=1)))
+        self.quads = np.stack((idx[:-1, :-1], idx[:-1, 1:], idx[1:, 1:], idx[1:, :-1]),
+                              axis=-1).reshape(-1, 4)                  # Вершины p1, p2, p3, p4 каждого четырёхугольника (Q, 4)
+
+
+@functools.lru_cache(maxsize=TOPOLOGY_CACHE_SIZE)
+def grid_topology(nu, nv):
+    return GridTopology(nu, nv)  # Одна топология на размер сетки — общая для всех поверхностей и параметров
+
+
+class Mesh:
+    def __init__(self, u_range, v_range, vertices):
+        self.u_range, self.v_range = u_range, v_range                  # Значения параметров по осям (равномерные или адаптивные)
+        self.shape = (len(u_range), len(v_range))
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 3)  # Мировые координаты (N, 3)
+        self.topology = grid_topology(*self.shape)
+        # Данные проекции; заполняются project_mesh для конкретной камеры
+        self.screen_xy = None                                          # Экранные координаты (N, 2), int32
+        self.depth = None                                              # Расстояние до камеры (N,), float32
+        self.visible = None                                            # Маска видимых вершин (N,)
+        self.quad_ids = None                                           # Номера видимых полигонов в порядке сетки
+        self.sorted_ids = None                                         # Те же полигоны от дальних к ближним (только для алгоритма художника)
+        self.edge_ids = None                                           # Номера видимых рёбер (None — видны все)
+        self.camera = None                                             # Версия камеры, для которой сделана проекция
+        self.cull = None                                               # Режим отсечения, с которым отобраны полигоны
+        self.cull_stats = None                                         # Сколько полигонов отброшено каждой проверкой
+
+    @property
+    def nbytes(self):
+        arrays = (self.u_range, self.v_range, self.vertices, self.screen_xy,
+                  self.depth, self.visible, self.quad_ids, self.sorted_ids, self.edge_ids)
+        return sum(arr.nbytes for arr in arrays if arr is not None)
+
+    def quads(self):
+        return self.topology.quads[self.quad_ids]                      # Вершины видимых полигонов (Z-буферу порядок не важен)
+
+    def painter_quads(self):
+        if self.sorted_ids is None:                                    # Проекция сделана для Z-буфера — сортировка по первому требованию
+            with profiler.stage("sort"):
+                self.sorted_ids = sort_quads(self.topology, self.quad_ids, self.depth)
+        return self.topology.quads[self.sorted_ids]                    # Вершины полигонов в порядке отрисовки
+
+    def edges(self):
+        if self.edge_ids is None:
+            return self.topology.edges
+        return self.topology.edges[self.edge_ids]
+
+
+def build_edges(topology, visible):
+    if visible.all():                                                  # Частый случай: вся сетка перед камерой
+        return None
+    edges = topology.edges
+    return np.flatnonzero(visible[edges[:, 0]] & visible[edges[:, 1]]).astype(np.int32)  # Отрезки между видимыми соседями
+
+
+def build_quads(topology, visible):
+    quads = topology.quads
+    if visible.all():
+        return np.arange(len(quads), dtype=np.int32)
+    complete = (visible[quads[:, 0]] & visible[quads[:, 1]] &
+                visible[quads[:, 2]] & visible[quads[:, 3]])           # Все четыре вершины должны быть видимы
+    return np.flatnonzero(complete).astype(np.int32)
+
+
+def quad_corners(grid):
+    return grid[:-1, :-1], grid[:-1, 1:], grid[1:, 1:], grid[1:, :-1]  # Углы p1..p4 всех полигонов срезами сетки, без выборки по индексам
+
+
+def cull_quads(topology, quad_ids, screen_xy, depth, visible, mode, size):
+    stats = {"input": len(quad_ids), "viewport": 0, "subpixel": 0, "backface": 0}
+    if mode == "off" or not len(quad_ids):
+        stats["drawn"] = len(quad_ids)
+        return quad_ids, stats
+    w, h = size
+    x = screen_xy[:, 0].reshape(topology.shape)                        # Экранные координаты на сетке (nu, nv)
+    y = screen_xy[:, 1].reshape(topology.shape)
+    keep = np.ones(len(quad_ids), dtype=bool)
+
+    # Флаги "за границей окна" считаются один раз на вершину; полигон отбрасывается, если все четыре
+    # угла за одной и той же границей
+    left, right, above, below = x < 0, x >= w, y < 0, y >= h
+    if (visible.reshape(topology.shape) & (left | right | above | below)).any():  # Иначе вся видимая сетка в окне
+        outside = np.zeros((topology.shape[0] - 1) * (topology.shape[1] - 1), dtype=bool)
+        for flag in (left, right, above, below):
+            p1, p2, p3, p4 = quad_corners(flag)
+            outside |= (p1 & p2 & p3 & p4).ravel()
+        outside = outside[quad_ids]
+        keep &= ~outside
+        stats["viewport"] = int(outside.sum())
+
+    if mode in ("subpixel", "backface"):
+        # Ориентированная площадь по формуле шнурков: модуль — площадь на экране, знак — порядок обхода вершин
+        xs = [c.astype(np.float64) for c in quad_corners(x)]
+        ys = [c.astype(np.float64) for c in quad_corners(y)]
+        area = 0.5 * sum(xs[i] * ys[(i + 1) % 4] - xs[(i + 1) % 4] * ys[i] for i in range(4))
+        area = area.ravel()[quad_ids]
+        tiny = keep & (np.abs(area) < CULL_SUBPIXEL_AREA)
+        keep &= ~tiny
+        stats["subpixel"] = int(tiny.sum())
+        if mode == "backface" and keep.any():
+            # Какой обход считать лицевым, зависит от параметризации поверхности: берём обход ближайшего
+            # к камере полигона — он заведомо повёрнут к зрителю
+            total = sum(quad_corners(depth.reshape(topology.shape))).ravel()[quad_ids]
+            nearest = np.flatnonzero(keep)[np.argmin(total[keep])]
+            back = keep & (area * np.sign(area[nearest]) < 0)
+            keep &= ~back
+            stats["backface"] = int(back.sum())
+
+    stats["drawn"] = int(keep.sum())
+    if stats["drawn"] == len(quad_ids):                                # Ничего не отброшено — без копирования
+        return quad_ids, stats
+    return quad_ids[keep], stats
+
+
+def sort_quads(topology, quad_ids, depth):
+    d = depth.reshape(topology.shape)
+    # Сумма глубин вершин упорядочивает полигоны так же, как средняя; считается срезами сетки, без выборки по индексам
+    total = (d[:-1, :-1] + d[:-1, 1:] + d[1:, 1:] + d[1:, :-1]).ravel()[quad_ids]
+    order = np.argsort(-total, kind='stable')                          # По убыванию глубины (алгоритм художника), порядок равных сохраняется
+    return quad_ids[order]
+
+
+def draw_fill(screen, screen_xy, quads):
+    for poly in screen_xy[quads].tolist():                             # Отрисовка всех полигонов от дальних к ближним
+        pygame.draw.polygon(screen, POLY_COLOR, poly)
+
+
+def rasterize_quads(screen_xy, depth, quads, size):
+    w, h = size
+    zbuf = np.full(w * h, np.inf)                                      # Буфер глубины (плоский, индекс y * w + x)
+
+    tris = np.concatenate((quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]))  # Каждый четырёхугольник — два треугольника
+    xy = screen_xy[tris].astype(float)                                 # Экранные вершины треугольников (T, 3, 2)
+    z = depth[tris]                                                    # Глубины вершин (T, 3)
+
+    d = ((xy[:, 1, 0] - xy[:, 0, 0]) * (xy[:, 2, 1] - xy[:, 0, 1]) -
+         (xy[:, 1, 1] - xy[:, 0, 1]) * (xy[:, 2, 0] - xy[:, 0, 0]))    # Удвоенная ориентированная площадь
+    y0 = np.clip(np.ceil(xy[:, :, 1].min(axis=1)), 0, h).astype(np.int64)   # Первая и последняя строки экрана,
+    y1 = np.clip(np.floor(xy[:, :, 1].max(axis=1)), -1, h - 1).astype(np.int64)  # которые пересекает треугольник
+    x0 = np.clip(xy[:, :, 0].min(axis=1), 0, w).astype(np.int64)
+    x1 = np.clip(xy[:, :, 0].max(axis=1), -1, w - 1).astype(np.int64)
+
+    keep = (d != 0) & (y1 >= y0) & (x1 >= x0)                          # Вырожденные и внеэкранные треугольники отбрасываются
+    xy, z, d, y0, y1, x0, x1 = xy[keep], z[keep], d[keep], y0[keep], y1[keep], x0[keep], x1[keep]
+    if len(xy) == 0:
+        return zbuf.reshape(h, w)
+
+    # Глубина линейна в экранном пространстве: z = A * x + B * y + C
+    dx1, dy1, dz1 = xy[:, 1, 0] - xy[:, 0, 0], xy[:, 1, 1] - xy[:, 0, 1], z[:, 1] - z[:, 0]
+    dx2, dy2, dz2 = xy[:, 2, 0] - xy[:, 0, 0], xy[:, 2, 1] - xy[:, 0, 1], z[:, 2] - z[:, 0]
+    A = (dz1 * dy2 - dz2 * dy1) / d
+    B = (dx1 * dz2 - dx2 * dz1) / d
+    C = z[:, 0] - A * xy[:, 0, 0] - B * xy[:, 0, 1]
+
+    rows = y1 - y0 + 1                                                 # Число строк развёртки у каждого треугольника
+    cum = np.cumsum(rows * (x1 - x0 + 1))                              # Верхняя оценка числа пикселей (площадь рамки)
+    start = 0
+    while start < len(rows):                                           # Обработка порциями, чтобы не раздувать память
+        base = cum[start - 1] if start else 0
+        end = max(int(np.searchsorted(cum, base + RASTER_CHUNK_PIXELS, side='right')), start + 1)
+        sl = slice(start, end)
+        start = end
+
+        # Пары (треугольник, строка развёртки)
+        n = rows[sl]
+        tri = np.repeat(np.arange(len(n)), n)
+        py = y0[sl][tri] + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        v = xy[sl][tri]
+
+        xl = np.full(len(py), np.inf)                                  # Левая и правая границы отрезка строки
+        xr = np.full(len(py), -np.inf)
+        for a, b in ((0, 1), (1, 2), (2, 0)):                          # Пересечение строки с каждым ребром
+            xa, ya, xb, yb = v[:, a, 0], v[:, a, 1], v[:, b, 0], v[:, b, 1]
+            hit = (py >= np.minimum(ya, yb)) & (py <= np.maximum(ya, yb))
+            dy = np.where(ya != yb, yb - ya, 1.0)
+            x = np.where(ya != yb, xa + (py - ya) / dy * (xb - xa), xa)
+            xl = np.where(hit, np.minimum(xl, np.minimum(x, np.where(ya == yb, xb, x))), xl)
+            xr = np.where(hit, np.maximum(xr, np.maximum(x, np.where(ya == yb, xb, x))), xr)
+
+        sx0 = np.clip(np.ceil(xl - 1e-9), 0, w).astype(np.int64)      # Отрезок строки в целых пикселях, обрезанный по экрану
+        sx1 = np.clip(np.floor(xr + 1e-9), -1, w - 1).astype(np.int64)
+        span = np.maximum(sx1 - sx0 + 1, 0)
+
+        # Раскрытие отрезков в отдельные пиксели
+        pair = np.repeat(np.arange(len(span)), span)
+        px = sx0[pair] + np.arange(span.sum()) - np.repeat(np.cumsum(span) - span, span)
+        py = py[pair]
+        t = tri[pair]
+        pz = A[sl][t] * px + B[sl][t] * py + C[sl][t]                   # Интерполированная глубина пикселя
+        np.minimum.at(zbuf, py * w + px, pz)                           # Ближайшая к камере точка побеждает
+
+    return zbuf.reshape(h, w)
+
+
+def draw_fill_zbuffer(screen, screen_xy, depth, quads):
+    zbuf = rasterize_quads(screen_xy, depth, quads, screen.get_size())  # Растеризация всех полигонов в буфер глубины
+    covered = np.isfinite(zbuf)                                        # Пиксели, покрытые поверхностью
+    if not covered.any():
+        return
+
+    near, far = zbuf[covered].min(), zbuf[covered].max()
+    shade = 1.0 - 0.5 * (zbuf[covered] - near) / max(far - near, 1e-9)  # Дальние пиксели темнее — глубина видна на заливке
+    colors = (np.array(POLY_COLOR[:3]) * shade[:, None]).astype(np.uint8)
+
+    frame = pygame.surfarray.pixels3d(screen)                          # Прямой доступ к пикселям экрана (x, y, rgb)
+    frame.transpose(1, 0, 2)[covered] = colors                         # Один перенос всего буфера цвета на экран
+    del frame                                                          # Снятие блокировки поверхности
+
+
+def draw_lines(screen, screen_xy, edges):
+    for p1, p2 in screen_xy[edges].tolist():                           # Отрисовка всех каркасных линий
+        pygame.draw.line(screen, LINE_COLOR, p1, p2)
+
+
+def polyline_runs(screen_xy, visible, shape, step=1):
+    nu, nv = shape
+    xy = screen_xy.reshape(nu, nv, 2)
+    vis = visible.reshape(nu, nv)
+    keep_u = np.unique(np.r_[0:nu:step, nu - 1])                       # Каждая k-я строка плюс последняя — граница сетки не теряется
+    keep_v = np.unique(np.r_[0:nv:step, nv - 1])
+    rows = (xy[keep_u], vis[keep_u])                                   # Строки сетки (u фиксировано)
+    cols = (xy[:, keep_v].transpose(1, 0, 2), vis[:, keep_v].T)        # Столбцы сетки (v фиксировано)
+
+    runs = []
+    for lines_xy, lines_vis in (rows, cols):
+        for points, mask in zip(lines_xy, lines_vis):
+            if mask.all():                                             # Вся линия видима — одна ломаная
+                runs.append(points)
+                continue
+            # Разрыв ломаной на отсечённых вершинах: границы непрерывных участков видимых точек
+            bounds = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0])))).reshape(-1, 2)
+            runs.extend(points[start:stop] for start, stop in bounds if stop - start >= 2)
+    return runs
 
-    poly_points = [[None for _ in v_range] for _ in u_range]           # Инициализация двумерного массива точек проекций
 
-    for i, u in enumerate(u_range):                                    # Перебор всех значений u
-        for j, v in enumerate(v_range):                                # Перебор всех значений v
-            x, y, z = surface_func(u, v, param_a, param_b)             # Вычисление 3D-координат поверхности в точке (u, v)
-            projected = project_point(x, y, z, width, height)          # Проецирование точки на экран
-            poly_points[i][j] = projected                              # Сохранение проекции в массив точек
+def draw_polylines(screen, screen_xy, visible, shape, step=1, antialias=False):
+    draw = pygame.draw.aalines if antialias else pygame.draw.lines
+    for run in polyline_runs(screen_xy, visible, shape, step):         # Один вызов на строку или столбец сетки
+        draw(screen, LINE_COLOR, False, run.tolist())
 
-    surface_lines = []  # Инициализация списка отрезков для каркаса
 
-    for i in range(len(u_range)):  # Проход по индексам массива u
-        for j in range(len(v_range)):  # Проход по индексам массива v
-            curr = poly_points[i][j]  # Текущая проецированная точка
-            if curr is None:  # Пропуск, если точка не определена
-                continue
-            if j < len(v_range) - 1:  # Проверка наличия правого соседа
-                right_ = poly_points[i][j + 1]  # Правая соседняя точка
-                if right_:  # Проверка на None
-                    surface_lines.append([curr, right_, LINE_COLOR])  # Добавление отрезка вправо
-            if i < len(u_range) - 1:  # Проверка наличия нижнего соседа
-                down = poly_points[i + 1][j]  # Нижняя соседняя точка
-                if down:  # Проверка на None
-                    surface_lines.append([curr, down, LINE_COLOR])  # Добавление отрезка вниз
-
-    polygons = []  # Инициализация списка полигонов (четырёхугольников)
-
-    for i in range(len(u_range) - 1):  # Проход по строкам (u)
-        for j in range(len(v_range) - 1):  # Проход по столбцам (v)
-            p1 = poly_points[i][j]  # Левая верхняя точка полигона
-            p2 = poly_points[i][j + 1]  # Правая верхняя точка полигона
-            p3 = poly_points[i + 1][j + 1]  # Правая нижняя точка полигона
-            p4 = poly_points[i + 1][j]  # Левая нижняя точка полигона
-            if None not in (p1, p2, p3, p4):  # Проверка на существование всех точек
-                avg_depth = (p1[2] + p2[2] + p3[2] + p4[2]) / 4  # Средняя глубина полигона для сортировки
-                polygons.append([avg_depth, [p1, p2, p3, p4]])  # Добавление полигона в список
-
-    polygons.sort(key=lambda x: -x[0])  # Сортировка полигонов по убыванию глубины (z-буфер)
-
-    for _, poly in polygons:  # Отрисовка всех полигонов
-        points_2d = [(p[0], p[1]) for p in poly]  # Извлечение 2D-координат
-        pygame.draw.polygon(screen, POLY_COLOR, points_2d)  # Отрисовка полигона на экране
-
-    for line in surface_lines:  # Отрисовка всех каркасных линий
-        p1, p2, color = line  # Извлечение начала, конца и цвета линии
-        pygame.draw.line(screen, color, (p1[0], p1[1]), (p2[0], p2[1]))  # Рисование линии между двумя точками
-
-    # Подписи осей
+def draw_wireframe(screen, mesh, mode):
+    if mode == "segments":                                             # Исходный способ: отдельный вызов на каждое ребро
+        draw_lines(screen, mesh.screen_xy, mesh.edges())
+    elif mode == "decimated":                                          # Редкий каркас поверх заливки полного разрешения
+        step = max(1, -(-max(mesh.shape) // WIRE_DECIMATED_LINES))
+        draw_polylines(screen, mesh.screen_xy, mesh.visible, mesh.shape, step)
+    else:
+        draw_polylines(screen, mesh.screen_xy, mesh.visible, mesh.shape, antialias=mode == "antialiased")
+
+
+def draw_axes(screen):
     axes = [  # Определение векторов координатных осей
         (np.array([10, 0, 0]), AXIS_COLORS[0]),  # Ось X — красная
         (np.array([0, 10, 0]), AXIS_COLORS[1]),  # Ось Y — зелёная
@@ -337,15 +1105,761 @@ def render_surface(screen, font, save_to_file=False):
                                  (end_proj[0], end_proj[1]), 2)  # Рисование линии оси с толщиной 2
 
 
+class GeometryCancelled(Exception):
+    pass  # Вычисление прервано: параметры успели измениться
+
+
+def compute_geometry(name, u_lim, v_lim, alpha, beta, ru, rv, tess="uniform", cancelled=None):
+    def checkpoint():                                                  # Проверка между этапами: не устарел ли запрос
+        if cancelled is not None and cancelled():
+            raise GeometryCancelled()
+
+    surface_func = surfaces[name]                                      # Получение функции поверхности по её имени
+    with profiler.stage("evaluate"):
+        if tess == "adaptive":                                         # Неравномерная сетка: гуще там, где поверхность сильнее изогнута
+            u_range, v_range, grid = adaptive_ranges(surface_func, u_lim, v_lim, alpha, beta, ru, rv)
+        else:
+            u_range = np.linspace(u_lim[0], u_lim[1], ru)              # Массив значений параметра u с равномерным шагом
+            v_range = np.linspace(v_lim[0], v_lim[1], rv)              # Массив значений параметра v с равномерным шагом
+            grid = evaluate_surface(surface_func, u_range, v_range, alpha, beta)  # Вычисление всей сетки за один вызов
+    checkpoint()
+    mesh = Mesh(u_range, v_range, grid)                                # Мировая геометрия не зависит от камеры
+    return project_mesh(mesh, checkpoint)
+
+
+def project_mesh(mesh, checkpoint=lambda: None):
+    version, view = camera_view                                        # Камера фиксируется на всё время проецирования
+    cull = render_settings["cull"]
+    topology = mesh.topology
+    with profiler.stage("project"):
+        screen_xy, depth, visible = project_points(mesh.vertices, width, height, view=view)  # Пакетное проецирование всех вершин
+    checkpoint()
+
+    with profiler.stage("edges"):
+        edge_ids = build_edges(topology, visible)                      # Отрезки каркаса между видимыми соседями
+    checkpoint()
+    with profiler.stage("polygons"):
+        quad_ids = build_quads(topology, visible)                      # Полигоны с четырьмя видимыми вершинами
+    checkpoint()
+    with profiler.stage("cull"):
+        quad_ids, cull_stats = cull_quads(topology, quad_ids, screen_xy, depth, visible, cull, (width, height))  # До сортировки и заливки
+    checkpoint()
+    sorted_ids = None                                                  # Z-буферу глобальная сортировка не нужна
+    if render_settings["fill"] == "painter":
+        with profiler.stage("sort"):
+            sorted_ids = sort_quads(topology, quad_ids, depth)         # Полигоны, отсортированные по убыванию глубины
+
+    projected = copy.copy(mesh)                                        # Новая запись, мировые массивы и топология общие
+    projected.screen_xy, projected.depth, projected.visible = screen_xy, depth.astype(np.float32), visible
+    projected.quad_ids, projected.edge_ids, projected.camera = quad_ids, edge_ids, version
+    projected.sorted_ids = sorted_ids
+    projected.cull, projected.cull_stats = cull, cull_stats
+    profiler.cull_stats = cull_stats                                   # Последние счётчики для оверлея
+    return projected
+
+
+view_memo = {"world": None, "mesh": None}  # Последняя перепроецированная сетка (одна запись)
+
+
+def projection_current(mesh):
+    return mesh.camera == camera_view[0] and mesh.cull == render_settings["cull"]
+
+
+def current_view(mesh):
+    if projection_current(mesh):                                       # Проекция сделана для текущей камеры и режима отсечения
+        return mesh
+    memo = view_memo
+    if memo["world"] is mesh and projection_current(memo["mesh"]):
+        return memo["mesh"]
+    # Камера сдвинулась или сменилось отсечение: переиспользуем вычисленную мировую сетку, функция поверхности не вызывается
+    memo["world"], memo["mesh"] = mesh, project_mesh(mesh)
+    return memo["mesh"]
+
+
+def get_geometry(name, u_lim, v_lim, alpha, beta, ru, rv, tess="uniform"):
+    key = geometry_key(name, u_lim, v_lim, alpha, beta, ru, rv, tess)
+    entry = geometry_cache.get(key)                                    # Повторные кадры с теми же параметрами берутся из кэша
+    if entry is None:
+        entry = compute_geometry(name, u_lim, v_lim, alpha, beta, ru, rv, tess)
+        geometry_cache.put(key, entry)
+    return entry
+
+
+def draw_geometry(screen, mesh):
+    with profiler.stage("fill"):
+        if render_settings["fill"] == "zbuffer":                       # Заливка через Z-буфер на NumPy
+            draw_fill_zbuffer(screen, mesh.screen_xy, mesh.depth, mesh.quads())
+        else:                                                          # Заливка полигонов алгоритмом художника
+            draw_fill(screen, mesh.screen_xy, mesh.painter_quads())
+    with profiler.stage("lines"):
+        draw_wireframe(screen, mesh, render_settings["wire"])          # Каркас поверх заливки
+    with profiler.stage("axes"):
+        draw_axes(screen)                                              # Оси координат
+
+
+# ------------------- ФОНОВОЕ ВЫЧИСЛЕНИЕ ГЕОМЕТРИИ -------------------
+class GeometryWorker:
+    def __init__(self, cache):
+        self.cache = cache
+        self.cond = threading.Condition()   # Защищает поля ниже и будит фоновый поток
+        self.latest = None                  # Ключ самого свежего запроса; всё остальное считается устаревшим
+        self.todo = None                    # (ключ, аргументы) ещё не взятого в работу запроса
+        self.done = None                    # (ключ, геометрия) последнего готового результата
+        self.cancelled = 0                  # Сколько вычислений прервано как устаревшие
+        self.failed = None                  # Ключ последнего запроса, упавшего с ошибкой (повторно не ставится)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="geometry-worker", daemon=True)
+        self.thread.start()
+
+    def fetch(self, args):
+        key = geometry_key(*args)
+        with self.cond:
+            done, latest = self.done, self.latest
+        if done is not None and done[0] == key:  # Нужная геометрия уже готова
+            return done[1]
+        if key != latest and key != self.failed:  # Параметры изменились с прошлого кадра
+            geom = self.cache.get(key)
+            with self.cond:
+                self.latest = key           # Текущее вычисление (если есть) становится устаревшим
+                if geom is not None:        # Попадание в кэш — показываем сразу, без фонового потока
+                    self.done, self.todo = (key, geom), None
+                    return geom
+                self.todo = (key, args)
+                self.cond.notify()
+        if done is not None and done[0][0] == key[0]:  # Пока считается новая — показываем прошлую сетку той же поверхности
+            return done[1]
+        return None
+
+    def pending(self):
+        with self.cond:
+            return self.latest is not None and (self.done is None or self.done[0] != self.latest)
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.latest = None              # Прерывание текущего вычисления
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and self.todo is None:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                key, args = self.todo
+                self.todo = None
+            try:
+                geom = compute_geometry(*args, cancelled=lambda: self.latest != key)
+            except GeometryCancelled:
+                with self.cond:
+                    self.cancelled += 1
+                continue
+            except Exception as err:        # Ошибка в функции поверхности не должна останавливать поток
+                print(f"Geometry failed for {key[0]}: {err!r}", file=sys.stderr)
+                with self.cond:
+                    self.failed = key
+                    if self.latest == key:  # Запрос снимается: pending() перестаёт показывать "Computing..."
+                        self.latest = None
+                continue
+            self.cache.put(key, geom)
+            with self.cond:
+                if self.latest == key:      # Результат публикуется, только если он всё ещё нужен
+                    self.done = (key, geom)
+
+
+geometry_worker = None  # Запускается в main(); без него геометрия считается синхронно (пакетный режим)
+
+
+# ------------------- ПРОГРЕССИВНАЯ ДЕТАЛИЗАЦИЯ -------------------
+lod_state = {"params": None, "changed_at": 0.0, "level": 0}  # Последние параметры, время их изменения и текущий уровень
+
+
+def lod_levels(ru, rv):
+    levels = []
+    for factor in LOD_FACTORS:  # От грубой сетки к полной; повторяющиеся уровни пропускаются
+        level = (max(4, -(-ru // factor)), max(4, -(-rv // factor)))
+        if level not in levels:
+            levels.append(level)
+    return levels
+
+
+def progressive_args(args, worker, now):
+    name, u_lim, v_lim, alpha, beta, ru, rv, tess = args
+    levels = lod_levels(ru, rv)
+    if args != lod_state["params"]:  # Параметры изменились — начинаем с грубой сетки
+        lod_state["params"], lod_state["changed_at"] = args, now
+        full_ready = worker.cache.contains(geometry_key(*args))
+        lod_state["level"] = len(levels) - 1 if full_ready else 0  # Полная сетка уже в кэше — уточнять нечего
+    elif (lod_state["level"] < len(levels) - 1 and not worker.pending()
+          and now - lod_state["changed_at"] >= LOD_SETTLE_SECONDS):
+        lod_state["level"] += 1  # Предыдущий уровень готов и параметры не меняются — следующий уровень
+    return (name, u_lim, v_lim, alpha, beta, *levels[lod_state["level"]], tess)
+
+
+def scene_geometry():
+    args = (current_surface_name, u_limits, v_limits, param_a, param_b, res_u, res_v, render_settings["tess"])
+    if geometry_worker is None:
+        return get_geometry(*args)                                     # Геометрия текущей поверхности (из кэша или заново)
+    if render_settings["lod"] == "progressive":                        # Сначала грубая сетка, затем уточнение до полной
+        args = progressive_args(args, geometry_worker, time.perf_counter())
+    return geometry_worker.fetch(args)                                 # Готовая геометрия или последняя готовая, пока считается новая
+
+
+def scene_signature(geom):
+    # Всё, от чего зависит картинка под панелью: если ничего не изменилось, кадр не перерисовывается
+    return (current_surface_name, param_a, param_b, res_u, res_v, tuple(render_settings.values()),
+            camera_view[0], geom, geometry_worker is not None and geometry_worker.pending())
+
+
+def render_surface(screen, font, geom):
+    if geom is not None:
+        draw_geometry(screen, current_view(geom))                      # Заливка, каркас и оси (с перепроецированием после движения камеры)
+    else:
+        draw_axes(screen)                                              # Первая сетка поверхности ещё не готова
+
+    if geometry_worker is not None and geometry_worker.pending():      # Индикатор фонового вычисления
+        text = render_text(font, "Computing...", TEXT_COLOR)
+        screen.blit(text, (10, height - text.get_height() - 10))
+
+
 def save_screenshot(screen):
     filename = f"screenshot_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.png"  # Формирование уникального имени файла с текущей датой и временем
     pygame.image.save(screen, filename)                                               # Сохранение содержимого экрана в файл PNG
     print(f"Saved screenshot: {filename}")                                            # Вывод сообщения об успешном сохранении
 
+
+# ------------------- ЭКСПОРТ СЕТКИ -------------------
+def grid_strips(name, u_lim, v_lim, alpha, beta, ru, rv, strip_rows=EXPORT_STRIP_ROWS):
+    surface_func = surfaces[name]
+    u_range = np.linspace(u_lim[0], u_lim[1], ru)
+    v_range = np.linspace(v_lim[0], v_lim[1], rv)
+    for start in range(0, ru, strip_rows):  # Полоса строк [start, stop); в памяти всегда только одна полоса
+        stop = min(start + strip_rows, ru)
+        yield start, evaluate_surface(surface_func, u_range[start:stop], v_range, alpha, beta)
+
+
+def quad_strips(ru, rv, strip_rows=EXPORT_STRIP_ROWS):
+    cols = np.arange(rv - 1)
+    for start in range(0, ru - 1, strip_rows):  # Индексы четырёхугольников считаются арифметически, без вершин
+        rows = np.arange(start, min(start + strip_rows, ru - 1))[:, None]
+        p1 = rows * rv + cols  # Та же нумерация p1, p2, p3, p4, что и в GridTopology
+        yield np.stack((p1, p1 + 1, p1 + rv + 1, p1 + rv), axis=-1).reshape(-1, 4)
+
+
+def mesh_comment(name, alpha, beta, ru, rv):
+    text = " ".join(f"{name} alpha={alpha} beta={beta} res={ru}x{rv}".split())  # Одна строка: перевод строки сломал бы заголовок PLY/OBJ
+    return text.encode("ascii", errors="replace")  # Имена из файлов формул могут быть не ASCII ("Сфера" -> "?????")
+
+
+def file_label(name):
+    label = "".join(c if c.isalnum() or c in "-." else "_" for c in name)  # Имена из файлов формул — произвольные строки ("Klein/Bottle")
+    return label.strip(".") or "surface"  # Без ведущих точек: файл не становится скрытым
+
+
+def write_ply(f, name, u_lim, v_lim, alpha, beta, ru, rv):
+    n_faces = (ru - 1) * (rv - 1)
+    header = (b"ply\nformat binary_little_endian 1.0\n" +
+              b"comment " + mesh_comment(name, alpha, beta, ru, rv) + b"\n" +
+              f"element vertex {ru * rv}\nproperty float x\nproperty float y\nproperty float z\n"
+              f"element face {n_faces}\nproperty list uchar int vertex_indices\nend_header\n".encode("ascii"))
+    f.write(header)
+    for _, strip in grid_strips(name, u_lim, v_lim, alpha, beta, ru, rv):
+        f.write(strip.astype("<f4").tobytes())  # Вершины полосы подряд, float32
+    face_dtype = np.dtype([("n", "u1"), ("idx", "<i4", (4,))])
+    for quads in quad_strips(ru, rv):
+        faces = np.empty(len(quads), dtype=face_dtype)
+        faces["n"], faces["idx"] = 4, quads
+        f.write(faces.tobytes())
+
+
+def write_stl(f, name, u_lim, v_lim, alpha, beta, ru, rv):
+    f.write(mesh_comment(name, alpha, beta, ru, rv)[:80].ljust(80, b"\0"))
+    f.write(np.uint32(2 * (ru - 1) * (rv - 1)).tobytes())  # Число треугольников известно заранее
+    tri_dtype = np.dtype([("normal", "<f4", (3,)), ("v", "<f4", (3, 3)), ("attr", "<u2")])
+    prev = None  # Последняя строка предыдущей полосы — нужна для четырёхугольников на стыке полос
+    for _, strip in grid_strips(name, u_lim, v_lim, alpha, beta, ru, rv):
+        rows = strip if prev is None else np.concatenate((prev, strip))
+        prev = strip[-1:]
+        if len(rows) < 2:
+            continue
+        p1, p2, p3, p4 = rows[:-1, :-1], rows[:-1, 1:], rows[1:, 1:], rows[1:, :-1]
+        tris = np.concatenate((np.stack((p1, p2, p3), axis=2).reshape(-1, 3, 3),
+                               np.stack((p1, p3, p4), axis=2).reshape(-1, 3, 3)))
+        normal = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+        length = np.linalg.norm(normal, axis=1, keepdims=True)
+        normal = np.divide(normal, length, out=np.zeros_like(normal), where=length > 0)  # Вырожденные треугольники — нулевая нормаль
+        out = np.zeros(len(tris), dtype=tri_dtype)
+        out["normal"], out["v"] = normal, tris
+        f.write(out.tobytes())
+
+
+def write_obj(f, name, u_lim, v_lim, alpha, beta, ru, rv):
+    f.write(b"# " + mesh_comment(name, alpha, beta, ru, rv) + b"\n")
+    for _, strip in grid_strips(name, u_lim, v_lim, alpha, beta, ru, rv):
+        np.savetxt(f, strip.reshape(-1, 3), fmt="v %.6g %.6g %.6g")
+    for quads in quad_strips(ru, rv):
+        np.savetxt(f, quads + 1, fmt="f %d %d %d %d")  # Индексы в OBJ начинаются с 1
+
+
+def export_mesh(path, fmt, name, u_lim, v_lim, alpha, beta, ru, rv):
+    writers = {"ply": write_ply, "stl": write_stl, "obj": write_obj}
+    with open(path, "wb") as f:  # Ошибка открытия — до блока очистки: чужой файл не удаляется
+        try:
+            writers[fmt](f, name, u_lim, v_lim, alpha, beta, ru, rv)
+        except BaseException:  # Включая Ctrl+C: недописанный файл не остаётся на диске
+            f.close()
+            os.remove(path)
+            raise
+    print(f"Saved mesh: {path} ({ru}x{rv}, {fmt.upper()})")
+    return path
+
+
+def save_mesh(fmt="ply"):
+    filename = f"mesh_{file_label(current_surface_name)}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"  # Имя файла как у скриншота
+    try:
+        return export_mesh(filename, fmt, current_surface_name, u_limits, v_limits, param_a, param_b, res_u, res_v)
+    except Exception as err:  # Кнопка Export: ошибка записи не должна ронять основной цикл
+        print(f"Export failed: {err!r}", file=sys.stderr)
+        return None
+
+
+def run_export(args):
+    if args.surface not in surfaces:
+        print(f"Unknown surface: {args.surface} (available: {', '.join(surfaces)})", file=sys.stderr)
+        return 2
+    fmt = args.format or os.path.splitext(args.out)[1].lstrip(".").lower()  # Формат по расширению файла
+    if fmt not in EXPORT_FORMATS:
+        print(f"Unknown mesh format: '{fmt}' (use --format {'/'.join(EXPORT_FORMATS)})", file=sys.stderr)
+        return 2
+    ru = args.res_u or args.res
+    rv = args.res_v or args.res
+    u_lim, v_lim = surface_bounds[args.surface]
+    alpha, beta = surface_defaults[args.surface]
+    alpha = alpha if args.alpha is None else args.alpha
+    beta = beta if args.beta is None else args.beta
+    export_mesh(args.out, fmt, args.surface, u_lim, v_lim, alpha, beta, ru, rv)
+    return 0
+
+
+# ------------------- ПАКЕТНЫЙ РЕЖИМ -------------------
+SWEEP_KEYS = ("alpha", "beta", "res", "res_u", "res_v")  # Параметры, которые можно перебирать через --sweep
+
+
+def parse_sweep(spec):
+    name, _, values = spec.partition("=")  # Формат: имя=начало:конец:шаг или имя=v1,v2,...
+    if name not in SWEEP_KEYS or not values:
+        raise argparse.ArgumentTypeError(f"invalid sweep '{spec}', expected one of {', '.join(SWEEP_KEYS)}=start:stop:step")
+    cast = int if name.startswith("res") else float  # Разрешение — целое, alpha и beta — вещественные
+    try:
+        if ":" in values:
+            start, stop, step = (float(x) for x in values.split(":"))
+            if not step > 0:  # Нулевой или отрицательный шаг дал бы деление на ноль или пустой перебор
+                raise argparse.ArgumentTypeError(f"sweep step must be positive in '{spec}'")
+            count = int(np.floor((stop - start) / step + 1e-9)) + 1  # Конец диапазона включается
+            grid = [cast(round(start + i * step, 9)) for i in range(max(count, 0))]
+        else:
+            grid = [cast(x) for x in values.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid sweep values in '{spec}'")
+    if not grid:
+        raise argparse.ArgumentTypeError(f"empty sweep '{spec}'")
+    return name, grid
+
+
+def batch_jobs(names, sweeps, res, fill, tess, wire, cull):
+    keys = [k for k, _ in sweeps]
+    for name in names:
+        alpha, beta = surface_defaults[name]  # Значения по умолчанию, как при выборе в меню
+        for combo in itertools.product(*(values for _, values in sweeps)):  # Все сочетания перебираемых параметров
+            job = dict(alpha=alpha, beta=beta, res_u=res, res_v=res, surface=name, fill=fill, tess=tess, wire=wire, cull=cull)
+            for key, value in zip(keys, combo):
+                if key == "res":
+                    job["res_u"] = job["res_v"] = value
+                else:
+                    job[key] = value
+            yield job
+
+
+def job_filename(job):
+    return (f"{file_label(job['surface'])}_a{job['alpha']:.4f}_b{job['beta']:.4f}"
+            f"_{job['res_u']}x{job['res_v']}.png")  # Имя файла однозначно описывает параметры кадра
+
+
+def render_job(job, out_dir):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Процесс-исполнитель работает без окна
+    render_settings["fill"] = job["fill"]
+    render_settings["wire"] = job["wire"]
+    render_settings["cull"] = job["cull"]
+    u_lim, v_lim = surface_bounds[job["surface"]]
+    geom = compute_geometry(job["surface"], u_lim, v_lim, job["alpha"], job["beta"],
+                            job["res_u"], job["res_v"], job["tess"])  # Без кэша: в пакете каждый кадр уникален
+    screen = pygame.Surface((width, height))  # Внеэкранная поверхность того же размера, что и окно
+    screen.fill(BG_COLOR)
+    draw_geometry(screen, geom)
+    path = os.path.join(out_dir, job_filename(job))
+    pygame.image.save(screen, path)  # Кадр пишется на диск прямо в процессе-исполнителе
+    return path
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))  # Учитывает ограничение ядер для процесса (контейнеры, taskset)
+    return os.cpu_count() or 1
+
+
+def run_batch(args):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Безголовый режим: SDL без реального окна
+    names = list(surfaces) if "all" in args.surface else args.surface
+    for name in names:
+        if name not in surfaces:
+            print(f"Unknown surface: {name} (available: {', '.join(surfaces)})", file=sys.stderr)
+            return 2
+
+    os.makedirs(args.out, exist_ok=True)
+    jobs = list(batch_jobs(names, args.sweep, args.res, args.fill, args.mesh, args.wire, args.cull))
+    workers = min(args.workers or available_cores(), len(jobs))
+    print(f"Rendering {len(jobs)} images with {workers} workers into {args.out}")
+
+    done = 0
+    # Исполнители загружают те же файлы формул (при запуске через spawn/forkserver реестр не наследуется)
+    with ProcessPoolExecutor(max_workers=workers, initializer=load_formulas, initargs=(args.formulas,)) as pool:
+        futures = [pool.submit(render_job, job, args.out) for job in jobs]
+        for future in as_completed(futures):  # Отчёт по мере готовности каждого кадра
+            done += 1
+            print(f"[{done}/{len(jobs)}] {future.result()}")
+    return 0
+
+
+def cli(argv):
+    parser = argparse.ArgumentParser(description="Parametric Surfaces Renderer")
+    parser.add_argument("--trace", help="interactive and animate modes: write stage timings as a Chrome trace JSON on exit")
+    parser.add_argument("--formulas", action="append", default=[],
+                        help="TOML/JSON file or directory with surface formulas (repeatable; formulas/ is always loaded)")
+    commands = parser.add_subparsers(dest="command")
+
+    render = commands.add_parser("render", help="headless batch rendering to PNG")
+    render.add_argument("--surface", action="append", required=True,
+                        help="surface name (repeatable) or 'all'")
+    render.add_argument("--sweep", action="append", type=parse_sweep, default=[],
+                        help="parameter sweep, e.g. alpha=0.1:2:0.1 or res=64,128 (repeatable)")
+    render.add_argument("--res", type=int, default=res_u, help="grid resolution for both u and v")
+    render.add_argument("--fill", choices=FILL_MODES, default=render_settings["fill"], help="fill mode")
+    render.add_argument("--wire", choices=WIRE_MODES, default=render_settings["wire"], help="wireframe mode")
+    render.add_argument("--cull", choices=CULL_MODES, default=render_settings["cull"], help="quad culling")
+    render.add_argument("--mesh", choices=TESS_MODES, default=render_settings["tess"],
+                        help="tessellation (with 'adaptive', --res is the upper bound per axis)")
+    render.add_argument("--workers", type=int, default=0, help="process count (default: available cores)")
+    render.add_argument("--out", required=True, help="output directory")
+    render.set_defaults(run=run_batch)
+
+    export = commands.add_parser("export", help="stream a surface mesh to PLY/STL/OBJ")
+    export.add_argument("--surface", required=True, help="surface name")
+    export.add_argument("--res", type=int, default=res_u, help="grid resolution for both u and v")
+    export.add_argument("--res-u", type=int, help="grid resolution along u (overrides --res)")
+    export.add_argument("--res-v", type=int, help="grid resolution along v (overrides --res)")
+    export.add_argument("--alpha", type=float, help="alpha parameter (default: surface default)")
+    export.add_argument("--beta", type=float, help="beta parameter (default: surface default)")
+    export.add_argument("--format", choices=EXPORT_FORMATS, help="mesh format (default: from --out extension)")
+    export.add_argument("--out", required=True, help="output file")
+    export.set_defaults(run=run_export)
+
+    animate = commands.add_parser("animate", help="render a keyframed alpha/beta animation to PNG frames or raw RGB")
+    animate.add_argument("--surface", required=True, help="surface name")
+    animate.add_argument("--key", action="append", type=parse_keyframe, required=True,
+                         help="keyframe, e.g. 0:beta=0.02 or 120:alpha=0.2,beta=0.1 (repeatable)")
+    animate.add_argument("--frames", type=int, default=0, help="frame count (default: last keyframe + 1)")
+    animate.add_argument("--ease", choices=ANIM_EASINGS, default="linear", help="interpolation between keyframes")
+    animate.add_argument("--res", type=int, default=res_u, help="grid resolution for both u and v")
+    animate.add_argument("--fill", choices=FILL_MODES, default=render_settings["fill"], help="fill mode")
+    animate.add_argument("--wire", choices=WIRE_MODES, default=render_settings["wire"], help="wireframe mode")
+    animate.add_argument("--cull", choices=CULL_MODES, default=render_settings["cull"], help="quad culling")
+    animate.add_argument("--format", choices=ANIM_FORMATS, default="png",
+                         help="numbered PNG files or raw RGB24 frames (default: png)")
+    animate.add_argument("--out", required=True, help="output directory (png) or file, '-' for stdout (raw)")
+    animate.set_defaults(run=run_animation)
+
+    bench = commands.add_parser("bench", help="per-stage rendering benchmark")
+    bench.add_argument("--surface", action="append", default=[], help="surface name (repeatable), default: all")
+    bench.add_argument("--res", type=lambda s: [int(x) for x in s.split(",")], default=list(BENCH_RESOLUTIONS),
+                       help="comma-separated resolutions (default: 16,32,64,128,256,512)")
+    bench.add_argument("--repeat", type=int, default=5, help="timed runs per case")
+    bench.add_argument("--fill", choices=FILL_MODES, default=render_settings["fill"], help="fill mode")
+    bench.add_argument("--wire", choices=WIRE_MODES, default=render_settings["wire"], help="wireframe mode")
+    bench.add_argument("--cull", choices=CULL_MODES, default=render_settings["cull"], help="quad culling")
+    bench.add_argument("--mesh", choices=TESS_MODES, default=render_settings["tess"], help="tessellation")
+    bench.add_argument("--out", help="write JSON report to this file")
+    bench.add_argument("--baseline", help="JSON report to compare against")
+    bench.add_argument("--threshold", type=float, default=0.2,
+                       help="allowed slowdown of a stage median before failing (default: 0.2 = 20%%)")
+    bench.set_defaults(run=run_benchmark)
+
+    args = parser.parse_args(argv)
+    args.formulas = [FORMULA_DIR] + args.formulas
+    load_formulas(args.formulas)  # Пользовательские поверхности регистрируются до меню и подкоманд
+    if args.command is None:  # Без подкоманды — обычный интерактивный режим
+        main(args.trace)
+        return 0
+    return args.run(args)
+
+
+# ------------------- БЕНЧМАРК -------------------
+BENCH_STAGES = ("evaluate", "project", "edges", "polygons", "cull", "sort", "fill", "lines", "axes")  # Этапы render_surface
+BENCH_RESOLUTIONS = (16, 32, 64, 128, 256, 512)  # Разрешения по умолчанию
+BENCH_MIN_DELTA_MS = 0.5  # Разница меньше этой не считается регрессией (шум таймера на быстрых этапах)
+
+
+def time_render_stages(screen, name, res, fill, tess="uniform", wire="segments", cull="viewport"):
+    render_settings.update(fill=fill, tess=tess, wire=wire, cull=cull)  # Те же режимы, что и при обычной отрисовке
+    u_lim, v_lim = surface_bounds[name]
+    alpha, beta = surface_defaults[name]  # Параметры, с которыми поверхность открывается из меню
+
+    # Замеряются сами функции отрисовки: этапы записывает профайлер внутри compute_geometry и draw_geometry
+    profiler.last.clear()
+    mesh = compute_geometry(name, u_lim, v_lim, alpha, beta, res, res, tess)
+    screen.fill(BG_COLOR)
+    draw_geometry(screen, mesh)
+    return {stage: profiler.last.get(stage, 0.0) for stage in BENCH_STAGES}  # Пропущенный этап (sort при Z-буфере) — 0
+
+
+def summarize(samples):
+    ms = np.array(samples) * 1000.0
+    return {"median_ms": float(np.median(ms)), "p10_ms": float(np.percentile(ms, 10)),
+            "p90_ms": float(np.percentile(ms, 90)), "p99_ms": float(np.percentile(ms, 99)),
+            "min_ms": float(ms.min()), "max_ms": float(ms.max()), "runs": len(ms)}
+
+
+def run_benchmark(args):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Бенчмарк работает без окна
+    names = list(surfaces) if not args.surface or "all" in args.surface else args.surface
+    for name in names:
+        if name not in surfaces:
+            print(f"Unknown surface: {name} (available: {', '.join(surfaces)})", file=sys.stderr)
+            return 2
+
+    screen = pygame.Surface((width, height))  # Внеэкранная поверхность размера окна
+    results = {}
+    for name in names:
+        results[name] = {}
+        for res in args.res:
+            time_render_stages(screen, name, res, args.fill, args.mesh, args.wire, args.cull)  # Прогревочный прогон не учитывается
+            runs = [time_render_stages(screen, name, res, args.fill, args.mesh, args.wire, args.cull)
+                    for _ in range(args.repeat)]
+            stages = {stage: summarize([run[stage] for run in runs]) for stage in BENCH_STAGES}
+            stages["total"] = summarize([sum(run.values()) for run in runs])
+            results[name][str(res)] = stages
+            print(f"{name:>10} {res:>4}: " +
+                  " ".join(f"{stage}={stages[stage]['median_ms']:.2f}" for stage in BENCH_STAGES) +
+                  f" | total={stages['total']['median_ms']:.2f} ms")
+
+    report = {
+        "meta": {"timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                 "python": platform.python_version(), "numpy": np.__version__,
+                 "pygame": pygame.version.ver, "platform": platform.platform(),
+                 "fill": args.fill, "mesh": args.mesh, "wire": args.wire, "cull": args.cull, "repeat": args.repeat,
+                 "params": {name: surface_defaults[name] for name in names}, "size": [width, height]},
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved benchmark: {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare_benchmarks(baseline, results, args.threshold)
+        for name, res, stage, old, new in regressions:
+            print(f"REGRESSION {name} {res} {stage}: {old:.2f} ms -> {new:.2f} ms "
+                  f"(+{(new / old - 1) * 100 if old else float('inf'):.0f}%)")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+def compare_benchmarks(baseline, results, threshold):
+    regressions = []
+    for name, by_res in results.items():
+        for res, stages in by_res.items():
+            base_stages = baseline.get(name, {}).get(res)
+            if base_stages is None:  # В базовом отчёте нет такого сочетания — сравнивать не с чем
+                continue
+            for stage, stats in stages.items():
+                if stage not in base_stages:
+                    continue
+                old, new = base_stages[stage]["median_ms"], stats["median_ms"]
+                if new > old * (1 + threshold) and new - old > BENCH_MIN_DELTA_MS:
+                    regressions.append((name, res, stage, old, new))
+    return regressions
+
+
+# ------------------- АНИМАЦИЯ -------------------
+ANIM_KEYS = ("alpha", "beta")  # Параметры, которые можно задавать в ключевых кадрах
+
+
+def parse_keyframe(spec):
+    frame, _, values = spec.partition(":")  # Формат: кадр:имя=значение,имя=значение
+    try:
+        frame = int(frame)
+        pairs = [item.split("=") for item in values.split(",")]
+        keys = {name: float(value) for name, value in pairs}
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid keyframe '{spec}', expected frame:alpha=0.1,beta=0.05")
+    unknown = set(keys) - set(ANIM_KEYS)
+    if frame < 0 or not keys or unknown:
+        raise argparse.ArgumentTypeError(f"invalid keyframe '{spec}', parameters: {', '.join(ANIM_KEYS)}")
+    return frame, keys
+
+
+def keyframe_value(keyframes, key, frame, default, ease):
+    points = sorted((f, values[key]) for f, values in keyframes if key in values)
+    if not points:  # Параметр не анимируется — значение по умолчанию для поверхности
+        return default
+    i = next((i for i, (f, _) in enumerate(points) if f > frame), len(points))
+    if i == 0:                      # До первого ключевого кадра значение держится
+        return points[0][1]
+    if i == len(points):            # После последнего — тоже
+        return points[-1][1]
+    (f0, v0), (f1, v1) = points[i - 1], points[i]
+    t = (frame - f0) / (f1 - f0)
+    if ease == "smooth":
+        t = t * t * (3 - 2 * t)     # Плавный разгон и торможение у ключевых кадров
+    return v0 + (v1 - v0) * t
+
+
+def animation_path(name, keyframes, frames, ease):
+    defaults = dict(zip(ANIM_KEYS, surface_defaults[name]))
+    return [tuple(keyframe_value(keyframes, key, frame, defaults[key], ease) for key in ANIM_KEYS)
+            for frame in range(frames)]
+
+
+def put_until(q, item, stop):
+    while not stop.is_set():        # Очередь полна — ждём, пока следующий этап заберёт элемент или конвейер остановится
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def get_until(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+
+def produce_geometry(name, path, res, meshes, stop):
+    u_lim, v_lim = surface_bounds[name]
+    try:
+        for alpha, beta in path:
+            # Разрешение постоянно: топология сетки (grid_topology) общая для всех кадров, меняются только вершины
+            mesh = compute_geometry(name, u_lim, v_lim, alpha, beta, res, res, cancelled=stop.is_set)
+            if not put_until(meshes, mesh, stop):
+                return
+        put_until(meshes, None, stop)               # Конец кадров
+    except GeometryCancelled:
+        pass
+    except Exception as err:                        # Ошибка передаётся в главный поток через очередь
+        put_until(meshes, err, stop)
+
+
+def encode_frames(fmt, out, frames, stop, errors):
+    stream = None
+    try:
+        if fmt == "raw":
+            stream = sys.stdout.buffer if out == "-" else open(out, "wb")
+        index = 0
+        while True:
+            data = get_until(frames, stop)
+            if data is None:                        # Кадры кончились или конвейер остановлен
+                return
+            with profiler.stage("encode"):
+                if fmt == "raw":
+                    stream.write(data)              # Сырой RGB24 без заголовков, например для ffmpeg -f rawvideo
+                else:
+                    image = pygame.image.frombytes(data, (width, height), "RGB")
+                    pygame.image.save(image, os.path.join(out, f"frame_{index:05d}.png"))
+            index += 1
+    except Exception as err:                        # Например, закрытый канал: останавливаем весь конвейер
+        errors.append(err)
+        stop.set()
+    finally:
+        if stream is not None:
+            stream.flush()
+            if stream is not sys.stdout.buffer:
+                stream.close()
+
+
+def run_animation(args):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Анимация рендерится без окна
+    if args.surface not in surfaces:
+        print(f"Unknown surface: {args.surface} (available: {', '.join(surfaces)})", file=sys.stderr)
+        return 2
+    log = sys.stderr if args.format == "raw" and args.out == "-" else sys.stdout  # stdout занят кадрами
+    frames_total = args.frames or max(frame for frame, _ in args.key) + 1
+    path = animation_path(args.surface, args.key, frames_total, args.ease)
+    if args.format == "png":
+        os.makedirs(args.out, exist_ok=True)
+    render_settings["fill"] = args.fill
+    render_settings["wire"] = args.wire
+    render_settings["cull"] = args.cull
+
+    # Три этапа работают одновременно: сетка кадра N+1 считается, пока кадр N растеризуется, а N-1 кодируется
+    meshes = queue.Queue(maxsize=ANIM_QUEUE_FRAMES)
+    frames = queue.Queue(maxsize=ANIM_QUEUE_FRAMES)
+    stop = threading.Event()
+    errors = []
+    geometry = threading.Thread(target=produce_geometry, name="anim-geometry",
+                                args=(args.surface, path, args.res, meshes, stop), daemon=True)
+    encoder = threading.Thread(target=encode_frames, name="anim-encoder",
+                               args=(args.format, args.out, frames, stop, errors), daemon=True)
+    geometry.start()
+    encoder.start()
+
+    print(f"Rendering {frames_total} frames of {args.surface} ({width}x{height}, {args.format}) into {args.out}", file=log)
+    start = time.perf_counter()
+    screen = pygame.Surface((width, height))        # Внеэкранная поверхность размера окна, одна на все кадры
+    rendered = 0
+    try:
+        while True:
+            mesh = get_until(meshes, stop)
+            if mesh is None:
+                break
+            if isinstance(mesh, Exception):
+                raise mesh
+            with profiler.stage("render"):
+                screen.fill(BG_COLOR)
+                draw_geometry(screen, mesh)
+                data = pygame.image.tobytes(screen, "RGB")
+            if not put_until(frames, data, stop):
+                break
+            rendered += 1
+        put_until(frames, None, stop)               # Кодировщик дописывает очередь и завершается
+        encoder.join()
+    finally:
+        stop.set()                                  # Остановка обоих потоков при ошибке или прерывании
+        geometry.join()
+        encoder.join()
+    if args.trace:
+        profiler.export_chrome_trace(args.trace, log)  # При выводе кадров в stdout сообщение уходит в stderr
+    if errors:
+        print(f"Encoding failed: {errors[0]}", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+    print(f"Rendered {rendered} frames in {elapsed:.1f} s ({rendered / elapsed:.1f} fps)", file=log)
+    return 0
+
+
 # ------------------- ОСНОВНОЙ ЦИКЛ -------------------
 
-def main():                                                                 # Главная функция запуска визуализатора
+def main(trace_path=None):                                                  # Главная функция запуска визуализатора; trace_path — куда выгрузить трассу кадров при выходе
     global current_surface_name, u_limits, v_limits, param_a, param_b, res_u, res_v  # Объявление глобальных переменных для параметров и состояния
+    global geometry_worker
 
     pygame.init()                                                           # Инициализация всех модулей Pygame
     screen = pygame.display.set_mode((width, height))                       # Создание окна с заданными размерами
@@ -353,24 +1867,43 @@ def main():                                                                 # Г
     font = pygame.font.SysFont("Arial", 18)                                # Создание шрифта Arial размером 18
 
     clock = pygame.time.Clock()                                             # Создание объекта для контроля частоты кадров
+    geometry_worker = GeometryWorker(geometry_cache)                        # Геометрия считается в фоне, цикл событий не блокируется
+    layout_control_panel()                                                  # Прямоугольники кнопок панели строятся один раз
     running = True                                                          # Флаг основного цикла
+    dragging = False                                                        # Идёт ли вращение камеры перетаскиванием
     in_menu = True                                                          # Флаг показа стартового меню
 
     while running:                                                          # Основной игровой цикл
+        profiler.begin_frame()                                              # Начало замера кадра
         mouse_pos = pygame.mouse.get_pos()                                  # Получение текущей позиции мыши
-        screen.fill(BG_COLOR)                                               # Очистка экрана заданным цветом фона
 
+        events_start = time.perf_counter()                                  # Начало замера обработки событий
         for event in pygame.event.get():  # Обработка всех событий в очереди
             if event.type == pygame.QUIT:  # Если нажата кнопка закрытия окна
                 running = False  # Завершение основного цикла
 
-            if event.type == pygame.MOUSEBUTTONDOWN:  # Если нажата кнопка мыши
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):  # Окно было перекрыто — нужен полный кадр
+                ui_state["scene"] = None
+
+            if event.type == pygame.MOUSEBUTTONUP and event.button == 1:  # Конец перетаскивания
+                dragging = False
+
+            if event.type == pygame.MOUSEMOTION and dragging:  # Вращение камеры вокруг сцены
+                orbit_camera(*event.rel)
+
+            if event.type == pygame.MOUSEWHEEL:
+                if in_menu:  # Прокрутка столбцов меню, если поверхностей больше, чем помещается
+                    menu_state["scroll"] -= event.y
+                else:  # Приближение и отдаление колёсиком
+                    zoom_camera(event.y)
+
+            if event.type == pygame.MOUSEBUTTONDOWN and event.button <= 3:  # Если нажата кнопка мыши (колёсико — отдельные события)
                 if in_menu:  # Если находимся в главном меню
                     for name, rect in surface_button_rects.items():  # Перебор всех кнопок выбора поверхности
                         if rect.collidepoint(mouse_pos):  # Если клик попал в кнопку
                             current_surface_name = name  # Установка выбранного имени поверхности
                             u_limits, v_limits = surface_bounds[name]  # Установка диапазонов параметров u и v
-                            param_a, param_b = 0.1, 0.05  # Начальные значения параметров alpha и beta
+                            param_a, param_b = surface_defaults[name]  # Начальные значения параметров alpha и beta
                             in_menu = False  # Переход в режим отображения поверхности
 
 
@@ -384,6 +1917,10 @@ def main():                                                                 # Г
                             mouse_pos):  # Кнопка "сохранить"
                         save_screenshot(screen)  # Вызов функции сохранения скриншота
 
+                    if control_buttons.get('export') and control_buttons['export'].collidepoint(
+                            mouse_pos):  # Кнопка "экспорт"
+                        save_mesh()  # Сохранение сетки текущей поверхности в PLY
+
                     # Управление параметрами
                     for key in plus_buttons.keys():  # Перебор всех "+" кнопок
                         if plus_buttons[key].collidepoint(mouse_pos):  # Если нажата кнопка "+"
@@ -406,25 +1943,83 @@ def main():                                                                 # Г
                             elif key == 'v':  # Уменьшение разрешения по v (не менее 4)
                                 res_v = max(4, res_v - 4)
 
-        if in_menu:  # Если активен режим меню
-            draw_menu_buttons(screen, font, mouse_pos)  # Отрисовка кнопок выбора поверхности
-        else:  # Если активен режим отображения поверхности
-            render_surface(screen, font)  # Отрисовка выбранной поверхности
-            draw_control_panel(screen, font, mouse_pos)  # Отрисовка панели управления параметрами
-            draw_menu_back_and_save(screen, font, mouse_pos)  # Отрисовка кнопок "назад" и "сохранить"
+                    for key, rect in mode_buttons.items():  # Переключение режимов отрисовки
+                        if rect.collidepoint(mouse_pos):
+                            options = mode_options[key]
+                            render_settings[key] = options[(options.index(render_settings[key]) + 1) % len(options)]
+
+                    ui_rects = [*control_buttons.values(), *plus_buttons.values(),
+                                *minus_buttons.values(), *mode_buttons.values()]
+                    if event.button == 1 and not in_menu and not any(r.collidepoint(mouse_pos) for r in ui_rects):
+                        dragging = True  # Клик мимо кнопок — начало вращения камеры
 
-        pygame.display.flip()  # Обновление содержимого экрана
-        clock.tick(30)  # Ограничение частоты кадров до 30 FPS
+        profiler.record("events", events_start, time.perf_counter() - events_start)
 
+        if in_menu:  # Если активен режим меню
+            geom = None
+            scene = ("menu", menu_state["scroll"], len(surfaces))
+        else:  # Если активен режим отображения поверхности
+            geom = scene_geometry()  # Запрос геометрии (фоновый поток или кэш) — без отрисовки
+            scene = scene_signature(geom)
+
+        if scene != ui_state["scene"] or render_settings["profiler"] == "on":  # Что-то изменилось — полный кадр
+            screen.fill(BG_COLOR)  # Очистка экрана заданным цветом фона
+            if in_menu:
+                draw_menu_buttons(screen, font, mouse_pos)  # Отрисовка кнопок выбора поверхности
+                scene = ("menu", menu_state["scroll"], len(surfaces))  # Прокрутка могла быть ограничена при раскладке
+            else:
+                with profiler.stage("render"):
+                    render_surface(screen, font, geom)  # Отрисовка выбранной поверхности
+                with profiler.stage("panel"):
+                    draw_control_panel(screen, font, mouse_pos)  # Отрисовка панели управления параметрами
+                    draw_menu_back_and_save(screen, font, mouse_pos)  # Отрисовка кнопок "назад" и "сохранить"
+                if render_settings["profiler"] == "on":
+                    draw_profiler_overlay(screen, font)  # Время этапов и гистограмма кадров
+            ui_state["scene"] = scene
+            ui_state["hover"] = hovered_button(hover_buttons(in_menu), mouse_pos)
+            dirty = [screen.get_rect()]
+        else:  # Сцена та же — перерисовываются только кнопки, у которых сменилось наведение
+            with profiler.stage("panel"):
+                dirty = update_hover(screen, font, hover_buttons(in_menu), mouse_pos)
+
+        with profiler.stage("flip"):
+            if dirty:
+                pygame.display.update(dirty)  # Обновление только изменившихся областей экрана
+        with profiler.stage("tick"):
+            clock.tick(30)  # Ограничение частоты кадров до 30 FPS
+        profiler.end_frame()  # Конец замера кадра
+
+    geometry_worker.stop()  # Остановка фонового вычислителя
+    if trace_path:
+        profiler.export_chrome_trace(trace_path)  # Выгрузка трассы кадров для chrome://tracing / Perfetto
     pygame.quit()  # Завершение работы Pygame
     sys.exit()  # Завершение программы
 
 
 # ------------------- Глобальные словари для кнопок -------------------
 surface_button_rects = {}
+menu_state = {"scroll": 0}  # Номер первого видимого столбца меню
+ui_state = {"scene": None, "hover": None}  # Что изображено на экране сейчас и какая кнопка подсвечена
 control_buttons = {}
 plus_buttons = {}
 minus_buttons = {}
+mode_buttons = {}
+
+panel_controls = [  # Параметры на панели: подпись и ключ (см. control_value)
+    ("Scale", 'a'),  # Масштаб
+    ("V-Resolution", 'v'),  # Разрешение по v
+    ("U-Resolution", 'u'),  # Разрешение по u
+    ("Detail", 'b'),  # Детализация поверхности
+]
+
+mode_controls = [  # Переключатели режимов отрисовки: подпись и ключ в render_settings
+    ("Fill", 'fill'),  # Способ заливки полигонов
+    ("LOD", 'lod'),  # Прогрессивная детализация
+    ("Mesh", 'tess'),  # Равномерная или адаптивная сетка
+    ("Wire", 'wire'),  # Способ отрисовки каркаса
+    ("Cull", 'cull'),  # Отсечение невидимых полигонов
+    ("Profiler", 'profiler'),  # Оверлей профайлера
+]
 
 if __name__ == "__main__":
-    main()
+    sys.exit(cli(sys.argv[1:]))